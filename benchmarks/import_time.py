@@ -0,0 +1,49 @@
+"""Check the cold start time of `leads.api`.
+
+Runs a fresh interpreter several times, imports `leads.api` and one task function,
+and fails if the best time exceeds the budget or if a heavy dependency was loaded.
+
+Usage:
+    python benchmarks/import_time.py [--budget 0.15] [--runs 5]
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+HEAVY_MODULES = ["openai", "tiktoken", "tqdm", "numpy", "pyarrow", "torch", "transformers", "vllm", "requests"]
+
+SNIPPET = """
+import sys, time, json
+start = time.perf_counter()
+from leads.api import screening_study
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=float, default=0.15, help="Max import time in seconds.")
+    parser.add_argument("--runs", type=int, default=5, help="Number of fresh interpreters to time.")
+    args = parser.parse_args()
+
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = []
+    for _ in range(args.runs):
+        output = subprocess.run([sys.executable, "-c", SNIPPET], cwd=repo_root, capture_output=True, text=True, check=True)
+        results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+
+    best = min(r["elapsed"] for r in results)
+    loaded = sorted({m for r in results for m in r["loaded"]})
+    print(f"import leads.api + screening_study: best {best * 1000:.1f} ms over {args.runs} runs (budget {args.budget * 1000:.0f} ms)")
+    if loaded:
+        print(f"heavy modules loaded at import time: {', '.join(loaded)}")
+    if best > args.budget or loaded:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
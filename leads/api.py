@@ -1,44 +1,60 @@
-from .modules.search import (
-    search_query_generation,
-    batch_search_query_generation
-)
-
-from .modules.screening import (
-    screening_study,
-    batch_screening_study
-)
-
-from .modules.study_characteristics_extraction import (
-    extract_study_characteristics,
-    batch_extract_study_characteristics
-)
-
-from .modules.population_statistics_extraction import (
-    extract_population_statistics,
-    batch_extract_population_statistics
-)
-
-from .modules.arm_design_extraction import (
-    extract_arm_design,
-    batch_extract_arm_design
-)
-
-from .modules.trial_result_extraction import (
-    extract_trial_result,
-    batch_extract_trial_result
-)
-
-__all__ = [
-    "search_query_generation",
-    "batch_search_query_generation",
-    "screening_study",
-    "batch_screening_study",
-    "extract_study_characteristics",
-    "batch_extract_study_characteristics",
-    "extract_population_statistics",
-    "batch_extract_population_statistics",
-    "extract_arm_design",
-    "batch_extract_arm_design",
-    "extract_trial_result",
-    "batch_extract_trial_result"
-]
\ No newline at end of file
+"""Public API of LEADS.
+
+Functions are imported on first access (PEP 562), so importing `leads.api` does not
+load the OpenAI client, the tokenizer or the other heavy dependencies.
+"""
+
+import importlib
+
+_LAZY_ATTRIBUTES = {
+    "search_query_generation": ".modules.search",
+    "batch_search_query_generation": ".modules.search",
+    "screening_study": ".modules.screening",
+    "batch_screening_study": ".modules.screening",
+    "extract_study_characteristics": ".modules.study_characteristics_extraction",
+    "batch_extract_study_characteristics": ".modules.study_characteristics_extraction",
+    "extract_population_statistics": ".modules.population_statistics_extraction",
+    "batch_extract_population_statistics": ".modules.population_statistics_extraction",
+    "extract_arm_design": ".modules.arm_design_extraction",
+    "batch_extract_arm_design": ".modules.arm_design_extraction",
+    "extract_trial_result": ".modules.trial_result_extraction",
+    "batch_extract_trial_result": ".modules.trial_result_extraction",
+    "iter_records": ".record_io",
+    "read_results": ".record_io",
+    "stream_screening_study": ".record_io",
+    "stream_extraction": ".record_io",
+    "to_label_matrix": ".screening_matrix",
+    "score_label_matrix": ".screening_matrix",
+    "exclusion_mask": ".screening_matrix",
+    "rank_records": ".screening_matrix",
+    "top_k": ".screening_matrix",
+    "screening_metrics": ".screening_matrix",
+    "EmbeddingIndex": ".prefilter",
+    "prefilter_records": ".prefilter",
+    "tune_prefilter_threshold": ".prefilter",
+    "prefiltered_batch_screening_study": ".prefilter",
+    "DedupIndex": ".dedup",
+    "dedup_batch_run": ".dedup",
+    "async_review_pipeline": ".pipeline",
+    "review_pipeline": ".pipeline",
+    "LivingReview": ".living_review",
+    "set_backend": ".client",
+    "get_backend": ".client",
+    "get_usage_stats": ".usage",
+    "plan_batch": ".planner",
+}
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name], __package__), name)
+    # cache the attribute, so __getattr__ is only called once per name
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
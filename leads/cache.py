@@ -0,0 +1,69 @@
+import json
+import hashlib
+import sqlite3
+import threading
+
+
+def task_key(task_name, **params):
+    """Build a stable key of a task and its parameters, e.g. the screening criteria."""
+    payload = json.dumps({"task": task_name, **params}, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _dumps(result):
+    # keep tuples (e.g. screening (evaluations, score) results) as tuples after a round trip
+    return json.dumps({"tuple": isinstance(result, tuple), "value": result})
+
+
+def _loads(payload):
+    payload = json.loads(payload)
+    return tuple(payload["value"]) if payload["tuple"] else payload["value"]
+
+
+class ResultCache:
+    """
+    A persistent cache of task results stored in SQLite, keyed by (record key, task key).
+
+    Use ":memory:" as path for a cache that only lives in this process.
+    """
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results (record TEXT, task TEXT, result TEXT, PRIMARY KEY (record, task))"
+        )
+        self._conn.commit()
+
+    def get_many(self, records, task):
+        """Return a dict of the cached results of the given record keys for the task."""
+        found = {}
+        records = list(dict.fromkeys(records))
+        with self._lock:
+            for i in range(0, len(records), 500):
+                chunk = records[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT record, result FROM results WHERE task = ? AND record IN ({','.join('?' * len(chunk))})",
+                    [task, *chunk],
+                ).fetchall()
+                found.update({record: _loads(result) for record, result in rows})
+        return found
+
+    def put_many(self, results, task):
+        """Store a dict of record key -> result for the task."""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO results (record, task, result) VALUES (?, ?, ?)",
+                [(record, task, _dumps(result)) for record, result in results.items()],
+            )
+            self._conn.commit()
+
+    def items(self, task):
+        """Return a dict of all the cached record keys -> results of the task."""
+        with self._lock:
+            rows = self._conn.execute("SELECT record, result FROM results WHERE task = ?", (task,)).fetchall()
+        return {record: _loads(result) for record, result in rows}
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,256 @@
+import re
+import json
+import math
+from collections import Counter
+from functools import lru_cache
+
+from .client import call_leads
+
+SECTION_NAMES = [
+    "title", "abstract", "background", "introduction", "objective", "objectives", "aims",
+    "methods", "materials and methods", "patients and methods", "study design", "participants",
+    "interventions", "outcomes", "statistical analysis", "results", "findings", "baseline characteristics",
+    "discussion", "limitations", "conclusion", "conclusions", "interpretation",
+    "references", "bibliography", "acknowledgements", "acknowledgments", "funding",
+    "conflicts of interest", "competing interests", "supplementary material", "appendix",
+]
+
+# sections that never hold the information targeted by the extraction tasks
+SKIPPED_SECTIONS = {
+    "references", "bibliography", "acknowledgements", "acknowledgments", "funding",
+    "conflicts of interest", "competing interests",
+}
+
+# sections always kept by `select_relevant_content`
+PINNED_SECTIONS = {"title", "abstract"}
+
+_SECTION_PATTERN = "|".join(re.escape(name) for name in sorted(SECTION_NAMES, key=len, reverse=True))
+# markdown headings, "[Abstract]" tags, numbered headings like "2. Methods" and "Results:" prefixes
+HEADING_PATTERN = re.compile(
+    rf"^\s*(?:#+\s*(?P<md>[^\n]+?)|\[(?P<tag>{_SECTION_PATTERN})\]|(?:\d+(?:\.\d+)*\.?\s+)?(?P<name>{_SECTION_PATTERN})\s*:?)\s*$"
+    rf"|^\s*(?:\[(?P<inline_tag>{_SECTION_PATTERN})\]|(?P<inline>{_SECTION_PATTERN})\s*:)",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+
+@lru_cache(maxsize=1)
+def get_encoding():
+    # loading the tokenizer takes a while, so only do it on first use
+    import tiktoken
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text):
+    return len(get_encoding().encode(text))
+
+
+def cut_paper_content(paper_content, max_tokens=29_000):
+    encoding = get_encoding()
+    tokens = encoding.encode(paper_content)
+    if len(tokens) > max_tokens:
+        tokens = tokens[:max_tokens]
+        paper_content = encoding.decode(tokens)
+    return paper_content
+
+
+def split_sections(paper_content):
+    """
+    Split a paper into sections based on its headings.
+
+    Args:
+        paper_content (str): The content of the paper.
+    Returns:
+        list: A list of (section name, section text) tuples, in the order of the paper.
+            Text before the first heading is in a section named "".
+    """
+    sections = []
+    name, start = "", 0
+    for match in HEADING_PATTERN.finditer(paper_content):
+        sections.append((name, paper_content[start:match.start()]))
+        heading = next(g for g in match.groups() if g)
+        name = heading.strip().lower()
+        # inline headings like "Results: ..." keep the text that follows on the same line
+        start = match.start() if (match.group("inline") or match.group("inline_tag")) else match.end()
+    sections.append((name, paper_content[start:]))
+    return [(name, text) for name, text in sections if text.strip()]
+
+
+def split_chunks(paper_content, chunk_tokens=512):
+    """
+    Split a paper into chunks of at most about `chunk_tokens` tokens that do not cross section borders.
+
+    Returns:
+        list: A list of dicts with "section", "text" and "num_tokens" keys, in the order of the paper.
+    """
+    chunks = []
+    for section, text in split_sections(paper_content):
+        current, current_tokens = [], 0
+        for paragraph in re.split(r"\n\s*\n", text):
+            if not paragraph.strip():
+                continue
+            num_tokens = count_tokens(paragraph)
+            if current and current_tokens + num_tokens > chunk_tokens:
+                chunks.append({"section": section, "text": "\n\n".join(current), "num_tokens": current_tokens})
+                current, current_tokens = [], 0
+            if num_tokens > chunk_tokens:
+                # cut very long paragraphs, e.g. flattened tables, into token windows
+                tokens = get_encoding().encode(paragraph)
+                for i in range(0, len(tokens), chunk_tokens):
+                    window = tokens[i:i + chunk_tokens]
+                    chunks.append({"section": section, "text": get_encoding().decode(window), "num_tokens": len(window)})
+                continue
+            current.append(paragraph.strip())
+            current_tokens += num_tokens
+        if current:
+            chunks.append({"section": section, "text": "\n\n".join(current), "num_tokens": current_tokens})
+    return chunks
+
+
+def _terms(text):
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def bm25_scores(query, documents, k1=1.5, b=0.75):
+    """Score documents against a query with Okapi BM25."""
+    docs = [Counter(_terms(doc)) for doc in documents]
+    if not docs:
+        return []
+    lengths = [sum(doc.values()) for doc in docs]
+    avg_length = sum(lengths) / len(docs) or 1.0
+    doc_freq = Counter(term for doc in docs for term in doc)
+    scores = []
+    for doc, length in zip(docs, lengths):
+        score = 0.0
+        for term in set(_terms(query)):
+            tf = doc.get(term, 0)
+            if tf == 0:
+                continue
+            idf = math.log(1 + (len(docs) - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / avg_length))
+        scores.append(score)
+    return scores
+
+
+def select_relevant_content(paper_content, query, max_tokens=29_000, chunk_tokens=512):
+    """
+    Keep the chunks of a paper most relevant to the query under a token budget.
+
+    Papers within the budget are returned unchanged. Otherwise, the paper is split into
+    section-aware chunks, reference-like sections are dropped, the first chunk and all the
+    chunks of the title and abstract sections are always kept, and the remaining chunks are
+    added by BM25 score until the budget is used. The kept chunks are returned in their
+    original order.
+
+    Args:
+        paper_content (str): The content of the paper.
+        query (str): The extraction target, e.g. the outcome and group definitions.
+        max_tokens (int): The token budget of the returned content.
+        chunk_tokens (int): The approx. size of the chunks.
+    Returns:
+        str: The selected content.
+    """
+    if count_tokens(paper_content) <= max_tokens:
+        return paper_content
+    chunks = [c for c in split_chunks(paper_content, chunk_tokens) if c["section"] not in SKIPPED_SECTIONS]
+    if not chunks:
+        return cut_paper_content(paper_content, max_tokens)
+
+    # query terms also match the section name, so e.g. "results" targets the Results section
+    scores = bm25_scores(query, [f"{c['section']} {c['text']}" for c in chunks])
+    selected = {i for i, c in enumerate(chunks) if i == 0 or c["section"] in PINNED_SECTIONS}
+    used = sum(chunks[i]["num_tokens"] for i in selected)
+    for i in sorted(set(range(len(chunks))) - selected, key=lambda i: scores[i], reverse=True):
+        # separators and section headers cost a few extra tokens per chunk
+        cost = chunks[i]["num_tokens"] + 8
+        if used + cost <= max_tokens:
+            selected.add(i)
+            used += cost
+
+    parts, last_section = [], None
+    for i in sorted(selected):
+        chunk = chunks[i]
+        # inline headings, e.g. "[Abstract] ...", are already part of the chunk text
+        has_heading = chunk["text"].lstrip("[# ").lower().startswith(chunk["section"])
+        if chunk["section"] != last_section and chunk["section"] and not has_heading:
+            parts.append(f"# {chunk['section'].title()}")
+        parts.append(chunk["text"])
+        last_section = chunk["section"]
+    return cut_paper_content("\n\n".join(parts), max_tokens)
+
+
+def truncate_paper_content(paper_content, query=None, max_tokens=29_000):
+    """Fit a paper into the token budget, keeping the chunks relevant to `query`, or the head of the paper if `query` is None."""
+    if query is None:
+        return cut_paper_content(paper_content, max_tokens)
+    return select_relevant_content(paper_content, query, max_tokens)
+
+
+def split_overlapping_chunks(paper_content, chunk_tokens=8_000, overlap_tokens=500):
+    """
+    Split a paper into token windows of `chunk_tokens` tokens, each overlapping the previous one by `overlap_tokens`.
+
+    Returns:
+        list[str]: The chunks, a single chunk if the paper fits into one.
+    """
+    assert overlap_tokens < chunk_tokens, "overlap_tokens must be smaller than chunk_tokens."
+    encoding = get_encoding()
+    tokens = encoding.encode(paper_content)
+    if len(tokens) <= chunk_tokens:
+        return [paper_content]
+    step = chunk_tokens - overlap_tokens
+    return [encoding.decode(tokens[i:i + chunk_tokens]) for i in range(0, len(tokens) - overlap_tokens, step)]
+
+
+EMPTY_VALUES = {"", "not found", "n/a", "na", "none", "null", "not reported", "not applicable", "unknown"}
+
+
+def is_empty_value(value):
+    return value is None or (isinstance(value, str) and value.strip().lower() in EMPTY_VALUES)
+
+
+def majority_vote(values):
+    """Return the most frequent non-empty value, ties go to the value seen first. None if all values are empty."""
+    counts, first = {}, {}
+    for i, value in enumerate(values):
+        if is_empty_value(value):
+            continue
+        key = value.strip().lower() if isinstance(value, str) else json.dumps(value, sort_keys=True)
+        counts[key] = counts.get(key, 0) + 1
+        first.setdefault(key, (i, value))
+    if not counts:
+        return None
+    best = max(counts, key=lambda key: (counts[key], -first[key][0]))
+    return first[best][1]
+
+
+def regroup_chunk_results(results, paper_chunks):
+    """Group the flat list of chunk results back into one list per paper."""
+    grouped, offset = [], 0
+    for chunks in paper_chunks:
+        grouped.append(results[offset:offset + len(chunks)])
+        offset += len(chunks)
+    return grouped
+
+
+def map_reduce_chunks(paper_contents, build_prompt, merge_fn, parse_fn=None, chunk_tokens=8_000, overlap_tokens=500, batch_size=20, **call_kwargs):
+    """
+    Run one prompt per overlapping chunk of each paper and merge the chunk results of each paper.
+
+    The chunks of all the papers are sent together, at most `batch_size` requests at a time.
+
+    Args:
+        paper_contents (list[str]): The contents of the papers.
+        build_prompt (callable): Maps a chunk to its prompt.
+        merge_fn (callable): Maps the list of (parsed) chunk results of a paper to the result of the paper.
+        parse_fn (callable): Optional function parsing each chunk output.
+        chunk_tokens (int): The size of the chunks.
+        overlap_tokens (int): The overlap of consecutive chunks.
+        batch_size (int): Max number of concurrent requests.
+        **call_kwargs: Other arguments of `call_leads`, e.g. `temperature` and `task`.
+    """
+    paper_chunks = [split_overlapping_chunks(paper_content, chunk_tokens, overlap_tokens) for paper_content in paper_contents]
+    prompts = [build_prompt(chunk) for chunks in paper_chunks for chunk in chunks]
+    results = call_leads(prompts, batch_size=batch_size, **call_kwargs)
+    if parse_fn is not None:
+        results = [parse_fn(result) for result in results]
+    return [merge_fn(chunk_results) for chunk_results in regroup_chunk_results(results, paper_chunks)]
@@ -1,25 +1,82 @@
 import os
+import time
 import asyncio
-from openai import AsyncOpenAI
-from tqdm import tqdm
+import threading
 
-async def call_llm_single(prompt, pmid, client, model="zifeng-ai/leads-mistral-7b-v1", temperature=1.0, max_tokens=1024):
-    """Make a single async call to the LLM."""
+def _split_completion_tokens(choices, usage):
+    """Return the number of tokens of each completion of a response."""
+    if usage is None:
+        return [None] * len(choices)
+    if len(choices) == 1:
+        return [usage.completion_tokens]
+    from .chunking import count_tokens
+    # the usage is only reported for all the completions together, so split it in proportion
+    # to the lengths of the completions, not evenly, to keep the long ones visible
+    lengths = [count_tokens(choice.message.content or "") for choice in choices]
+    total = sum(lengths)
+    if total == 0:
+        return [usage.completion_tokens // len(choices)] * len(choices)
+    return [round(usage.completion_tokens * length / total) for length in lengths]
+
+async def call_llm_single(prompt, pmid, client, model="zifeng-ai/leads-mistral-7b-v1", temperature=1.0, max_tokens=1024, n=1):
+    """Make a single async call to the LLM. With n > 1, the response is the list of the n sampled completions.
+
+    The returned dict also has the "prompt_tokens", "completion_tokens" (one count per completion)
+    and "finish_reasons" (one per completion) reported by the server.
+    """
     try:
         response = await client.chat.completions.create(
             model=model,
             messages=[{"role": "user", "content": prompt}],
             temperature=temperature,
             max_tokens=max_tokens,
+            n=n,
         )
-        return {"pmid": pmid, "response": response.choices[0].message.content}
+        usage = response.usage
+        output = {
+            "pmid": pmid,
+            "prompt_tokens": usage.prompt_tokens if usage else None,
+            "completion_tokens": _split_completion_tokens(response.choices, usage),
+            "finish_reasons": [choice.finish_reason for choice in response.choices],
+        }
+        if n > 1:
+            return {**output, "response": [choice.message.content for choice in response.choices]}
+        return {**output, "response": response.choices[0].message.content}
     except Exception as e:
         print(f"Error in LLM call for PMID {pmid}: {str(e)}")
-        return {"pmid": pmid, "response": ""}
+        return {"pmid": pmid, "response": [""] * n if n > 1 else "", "prompt_tokens": None, "completion_tokens": [None] * n, "finish_reasons": ["error"] * n}
 
-async def batch_call_leads_with_client(prompts, pmids, model="leads-mistral-7b-v0.3", batch_size=20, endpoint=None, api_key=None, temperature=1.0, max_tokens=1024):
-    """Process multiple prompts in parallel batches with proper client management."""
+async def batch_call_leads(prompts, pmids, client, model="leads-mistral-7b-v0.3", batch_size=20, temperature=1.0, max_tokens=1024, n=1, return_outputs=False):
+    """Process multiple prompts in parallel batches with an existing client.
+
+    With return_outputs=True, return the dicts of `call_llm_single` (with the token usage) instead of the responses.
+    """
+    from tqdm import tqdm
+
+    all_responses = []
+    for i in tqdm(range(0, len(prompts), batch_size)):
+        batch_prompts = prompts[i:i + batch_size]
+        batch_pmids = pmids[i:i + batch_size]
+        print(f"Processing batch {i//batch_size + 1}/{(len(prompts) + batch_size - 1)//batch_size}")
+        
+        tasks = [call_llm_single(prompt, pmid, client, model, temperature, max_tokens, n) 
+                for prompt, pmid in zip(batch_prompts, batch_pmids)]
+        
+        batch_responses = await asyncio.gather(*tasks)
+        all_responses.extend(batch_responses)
+        
+        if i + batch_size < len(prompts):
+            await asyncio.sleep(1)
+    
+    response_dict = {resp["pmid"]: resp for resp in all_responses}
+    ordered_responses = [response_dict[pmid] if return_outputs else response_dict[pmid]["response"] for pmid in pmids]
     
+    return ordered_responses
+
+async def batch_call_leads_with_client(prompts, pmids, model="leads-mistral-7b-v0.3", batch_size=20, endpoint=None, api_key=None, temperature=1.0, max_tokens=1024, n=1, return_outputs=False):
+    """Process multiple prompts in parallel batches with proper client management."""
+    from openai import AsyncOpenAI
+
     if endpoint is None:
         endpoint = os.getenv("LEADS_ENDPOINT")
     if api_key is None:
@@ -29,28 +86,204 @@ async def batch_call_leads_with_client(prompts, pmids, model="leads-mistral-7b-v
         api_key=api_key,
         base_url=endpoint,
     ) as client:
-        all_responses = []
-        for i in tqdm(range(0, len(prompts), batch_size)):
-            batch_prompts = prompts[i:i + batch_size]
-            batch_pmids = pmids[i:i + batch_size]
-            print(f"Processing batch {i//batch_size + 1}/{(len(prompts) + batch_size - 1)//batch_size}")
-            
-            tasks = [call_llm_single(prompt, pmid, client, model, temperature, max_tokens) 
-                    for prompt, pmid in zip(batch_prompts, batch_pmids)]
-            
-            batch_responses = await asyncio.gather(*tasks)
-            all_responses.extend(batch_responses)
-            
-            if i + batch_size < len(prompts):
-                await asyncio.sleep(1)
-        
-        response_dict = {resp["pmid"]: resp["response"] for resp in all_responses}
-        ordered_responses = [response_dict[pmid] for pmid in pmids]
-        
-        return ordered_responses
+        return await batch_call_leads(prompts, pmids, client, model, batch_size, temperature, max_tokens, n, return_outputs)
+
+class LeadsBackend:
+    """Interface of the backends that run the LEADS model for `call_leads`.
+
+    Backends implement `generate_outputs`, or only `generate` if they cannot report the token usage.
+    """
+
+    def generate(self, prompts, prompt_ids, model, batch_size=20, endpoint=None, api_key=None, temperature=1.0, max_tokens=1024, n=1):
+        """Return the responses to the prompts, in the same order. With n > 1, each response is a list of n completions."""
+        outputs = self.generate_outputs(prompts, prompt_ids, model, batch_size, endpoint, api_key, temperature, max_tokens, n)
+        return [output["response"] for output in outputs]
+
+    def generate_outputs(self, prompts, prompt_ids, model, batch_size=20, endpoint=None, api_key=None, temperature=1.0, max_tokens=1024, n=1):
+        """
+        Return one dict per prompt, in the same order, with the "response", "prompt_tokens",
+        "completion_tokens" (one count per completion) and "finish_reasons" (one per completion) keys.
+        The counts and finish reasons are None when the backend does not report them.
+        """
+        if type(self).generate is LeadsBackend.generate:
+            raise NotImplementedError
+        responses = self.generate(prompts, prompt_ids, model, batch_size, endpoint, api_key, temperature, max_tokens, n)
+        return [{"response": response, "prompt_tokens": None, "completion_tokens": [None] * n, "finish_reasons": [None] * n} for response in responses]
+
+    def cache_id(self):
+        """Return an ID of the model served by the backend, used to key cached results."""
+        return type(self).__name__
+
+
+class OpenAIBackend(LeadsBackend):
+    """Call a vLLM (or any OpenAI compatible) server over HTTP.
+
+    Args:
+        endpoint (str): The server URL. Takes precedence over the one passed to `call_leads`,
+            which is used if None, then LEADS_ENDPOINT.
+        api_key (str): The API key. Takes precedence over the one passed to `call_leads`,
+            which is used if None, then LEADS_API_KEY.
+        persistent (bool): If True, keep one client and its connection pool open on a background
+            event loop and share it across calls and threads, instead of one client per call.
+    """
+
+    def __init__(self, endpoint=None, api_key=None, persistent=False):
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.persistent = persistent
+        self._loop = None
+        self._client = None
+        self._lock = threading.Lock()
+
+    def cache_id(self):
+        return f"openai:{self.endpoint or os.getenv('LEADS_ENDPOINT')}"
+
+    def _get_client_loop(self, endpoint, api_key):
+        with self._lock:
+            if self._loop is None:
+                from openai import AsyncOpenAI
+                self._client = AsyncOpenAI(
+                    api_key=self.api_key or api_key or os.getenv("LEADS_API_KEY"),
+                    base_url=self.endpoint or endpoint or os.getenv("LEADS_ENDPOINT"),
+                )
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="leads-openai-client", daemon=True).start()
+        return self._client, self._loop
+
+    def generate_outputs(self, prompts, prompt_ids, model, batch_size=20, endpoint=None, api_key=None, temperature=1.0, max_tokens=1024, n=1):
+        if self.persistent:
+            client, loop = self._get_client_loop(endpoint, api_key)
+            future = asyncio.run_coroutine_threadsafe(
+                batch_call_leads(prompts, prompt_ids, client, model, batch_size, temperature, max_tokens, n, return_outputs=True),
+                loop,
+            )
+            return future.result()
+        return asyncio.run(
+            batch_call_leads_with_client(
+                prompts,
+                prompt_ids,
+                model,
+                batch_size,
+                self.endpoint or endpoint,
+                self.api_key or api_key,
+                temperature,
+                max_tokens,
+                n,
+                return_outputs=True
+            )
+        )
+
+
+class VLLMBackend(LeadsBackend):
+    """Run the LEADS model in-process with vLLM's offline engine, submitting all prompts at once.
+
+    Args:
+        model (str): The model path or name, defaults to the MODEL_PATH environment variable.
+        **engine_kwargs: Extra arguments of `vllm.LLM`, e.g. `gpu_memory_utilization`.
+    """
+
+    def __init__(self, model=None, **engine_kwargs):
+        self.model = model or os.getenv("MODEL_PATH", "zifeng-ai/leads-mistral-7b-v1")
+        self.engine_kwargs = engine_kwargs
+        self._llm = None
+        # the offline engine is not thread-safe, e.g. when used by the review pipeline
+        self._lock = threading.Lock()
+
+    def cache_id(self):
+        return f"vllm:{self.model}"
+
+    @property
+    def llm(self):
+        # loading the engine takes minutes, so only do it on first use
+        if self._llm is None:
+            from vllm import LLM
+            self._llm = LLM(model=self.model, **self.engine_kwargs)
+        return self._llm
+
+    def generate_outputs(self, prompts, prompt_ids, model, batch_size=20, endpoint=None, api_key=None, temperature=1.0, max_tokens=1024, n=1):
+        from vllm import SamplingParams
+        conversations = [[{"role": "user", "content": prompt}] for prompt in prompts]
+        with self._lock:
+            outputs = self.llm.chat(
+                conversations,
+                SamplingParams(temperature=temperature, max_tokens=max_tokens, n=n),
+                use_tqdm=True,
+            )
+        return [{
+            "response": [completion.text for completion in output.outputs] if n > 1 else output.outputs[0].text,
+            "prompt_tokens": len(output.prompt_token_ids),
+            "completion_tokens": [len(completion.token_ids) for completion in output.outputs],
+            "finish_reasons": [completion.finish_reason for completion in output.outputs],
+        } for output in outputs]
+
+
+class FakeBackend(LeadsBackend):
+    """A backend for CPU-only testing that returns canned responses.
+
+    Args:
+        response (str or callable): The response to every prompt, or a function mapping a prompt to its response.
+    """
+
+    def __init__(self, response=""):
+        self.response = response
+        self.calls = []
+
+    def generate_outputs(self, prompts, prompt_ids, model, batch_size=20, endpoint=None, api_key=None, temperature=1.0, max_tokens=1024, n=1):
+        self.calls.append({"prompts": list(prompts), "temperature": temperature, "max_tokens": max_tokens, "n": n})
+        responses = [self.response(prompt) if callable(self.response) else self.response for prompt in prompts]
+        return [{
+            "response": [response] * n if n > 1 else response,
+            "prompt_tokens": None,
+            "completion_tokens": [None] * n,
+            "finish_reasons": ["stop"] * n,
+        } for response in responses]
+
+
+BACKENDS = {
+    "openai": OpenAIBackend,
+    "vllm": VLLMBackend,
+    "fake": FakeBackend,
+}
+
+_backend = None
+
+def set_backend(backend="openai", **kwargs):
+    """
+    Set the backend used by `call_leads`, and so by every `leads.api` function.
+
+    Args:
+        backend (str or LeadsBackend): A backend instance, or one of "openai", "vllm" or "fake".
+        **kwargs: Arguments of the backend class when a name is given.
+    Returns:
+        LeadsBackend: The backend in use.
+    """
+    global _backend
+    _backend = BACKENDS[backend](**kwargs) if isinstance(backend, str) else backend
+    return _backend
+
+def get_backend():
+    """Return the backend used by `call_leads`, by default the one named by the LEADS_BACKEND environment variable or "openai"."""
+    if _backend is None:
+        set_backend(os.getenv("LEADS_BACKEND", "openai"))
+    return _backend
+
+def call_leads(prompts, prompt_ids=None, model="zifeng-ai/leads-mistral-7b-v1", batch_size=20, endpoint=None, api_key=None, temperature=1.0, max_tokens=None, n=1, task=None, max_retry_tokens=4096):
+    """Synchronous wrapper for batch processing with LEADS model.
+
+    With n > 1, n completions are sampled in a single request per prompt (sharing the prefill),
+    and each response is the list of the n completions.
+
+    The token usage and the duration of the call are recorded in `leads.usage.get_usage_stats()`
+    under `task`, e.g. "screening", for the planner.
+
+    With max_tokens=None, the output budget learned from the recorded completions of the task is
+    used (see `UsageStats.output_budget`), so vLLM does not reserve KV cache for tokens that are
+    never generated. The prompts whose completion was cut at that budget (finish reason "length")
+    are then sent again with twice the budget, up to `max_retry_tokens`. An explicit max_tokens
+    is a hard limit and is never raised.
+    """
+    from .usage import get_usage_stats
 
-def call_leads(prompts, prompt_ids=None, model="zifeng-ai/leads-mistral-7b-v1", batch_size=20, endpoint=None, api_key=None, temperature=1.0, max_tokens=1024):
-    """Synchronous wrapper for batch processing with LEADS model."""    
     if isinstance(prompts, str):
         prompts = [prompts]
         prompt_ids = [prompt_ids] if prompt_ids else [0]
@@ -60,18 +293,32 @@ def call_leads(prompts, prompt_ids=None, model="zifeng-ai/leads-mistral-7b-v1",
         if prompt_ids is None:
             prompt_ids = list(range(len(prompts)))
 
-    # Run the async function
-    responses = asyncio.run(
-        batch_call_leads_with_client(
-            prompts, 
-            prompt_ids, 
+    stats = get_usage_stats()
+    adaptive = max_tokens is None
+    if adaptive:
+        max_tokens = stats.output_budget(task)
+    outputs = [None] * len(prompts)
+    pending = list(range(len(prompts)))
+    while pending:
+        start = time.perf_counter()
+        new_outputs = get_backend().generate_outputs(
+            [prompts[i] for i in pending], 
+            [prompt_ids[i] for i in pending], 
             model, 
             batch_size, 
             endpoint,
             api_key,
             temperature, 
-            max_tokens
+            max_tokens,
+            n=n
         )
-    )
+        stats.record(task, [prompts[i] for i in pending], new_outputs, time.perf_counter() - start)
+        for i, output in zip(pending, new_outputs):
+            outputs[i] = output
+        if not adaptive or max_tokens >= max_retry_tokens:
+            break
+        pending = [i for i in pending if "length" in outputs[i]["finish_reasons"]]
+        max_tokens = min(max_tokens * 2, max_retry_tokens)
+    responses = [output["response"] for output in outputs]
     
     return responses[0] if single_prompt else responses
@@ -0,0 +1,53 @@
+import requests
+
+CTGOV_API_URL = "https://clinicaltrials.gov/api/v2/studies"
+
+
+def _study_to_record(study):
+    protocol = study.get("protocolSection", {})
+    identification = protocol.get("identificationModule", {})
+    description = protocol.get("descriptionModule", {})
+    conditions = protocol.get("conditionsModule", {}).get("conditions", [])
+    interventions = [i.get("name", "") for i in protocol.get("armsInterventionsModule", {}).get("interventions", [])]
+    status = protocol.get("statusModule", {})
+    title = identification.get("officialTitle") or identification.get("briefTitle", "")
+    summary = description.get("briefSummary", "")
+    return {
+        "id": identification.get("nctId"),
+        "title": title,
+        "abstract": summary,
+        "last_update": status.get("lastUpdatePostDateStruct", {}).get("date"),
+        "paper_content": (
+            f"[Title] {title}\n[Abstract] {summary}\n"
+            f"Conditions: {', '.join(conditions)}\nInterventions: {', '.join(interventions)}"
+        ),
+    }
+
+
+def search_ctgov(query, max_records=100, page_size=100, last_update_from=None):
+    """
+    Search ClinicalTrials.gov and return the matching studies.
+
+    Args:
+        query (str): The search terms, e.g. one of the sub-queries of `search_query_generation`.
+        max_records (int): Max number of studies to return, None to page through all the matching studies.
+        page_size (int): Number of studies per request.
+        last_update_from (str): Only return studies first posted or updated on or after this date (YYYY-MM-DD).
+    Returns:
+        list[dict]: One record per study with "id" (the NCT ID), "title", "abstract", "last_update" and "paper_content" keys.
+    """
+    records, page_token = [], None
+    while max_records is None or len(records) < max_records:
+        params = {"query.term": query, "pageSize": page_size if max_records is None else min(page_size, max_records - len(records)), "format": "json"}
+        if last_update_from:
+            params["filter.advanced"] = f"AREA[LastUpdatePostDate]RANGE[{last_update_from},MAX]"
+        if page_token:
+            params["pageToken"] = page_token
+        response = requests.get(CTGOV_API_URL, params=params, timeout=60)
+        response.raise_for_status()
+        payload = response.json()
+        records.extend(_study_to_record(study) for study in payload.get("studies", []))
+        page_token = payload.get("nextPageToken")
+        if not page_token:
+            break
+    return records
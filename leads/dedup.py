@@ -0,0 +1,173 @@
+import re
+import hashlib
+import numpy as np
+
+from .cache import ResultCache, task_key
+from .chunking import is_empty_value
+from .client import get_backend
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def normalize_text(text):
+    """Lowercase and collapse punctuation/whitespace, so formatting differences do not break exact matching."""
+    return " ".join(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+def exact_hash(text):
+    return hashlib.sha1(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def _shingles(text, size=3):
+    words = normalize_text(text).split()
+    if len(words) < size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class MinHasher:
+    """MinHash signatures of word 3-gram shingles, using universal hashing with fixed seeds."""
+
+    def __init__(self, num_perm=128, seed=1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self._a = rng.randint(1, _MAX_HASH, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, _MAX_HASH, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text):
+        hashes = np.array(
+            [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") for s in _shingles(text)],
+            dtype=np.uint64,
+        )
+        # (a * x + b) mod p stays below 2^64 since a, x < 2^32 and b < 2^32
+        permuted = (np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME
+        return (permuted.min(axis=0) & _MAX_HASH).astype(np.uint32)
+
+
+class DedupIndex:
+    """
+    A persistent index that maps records to duplicate clusters.
+
+    Records with the same normalized text (exact hash) or with an estimated Jaccard
+    similarity of at least `threshold` (MinHash + LSH banding) share a cluster. Task
+    results are cached per cluster, so a study is only screened or extracted once,
+    across sub-queries and across reviews that share the same index.
+
+    Args:
+        path (str): Path of the SQLite database, ":memory:" for a non-persistent index.
+        threshold (float): Min estimated Jaccard similarity of near-duplicates.
+        num_perm (int): Number of MinHash permutations.
+        bands (int): Number of LSH bands, must divide num_perm.
+    """
+
+    def __init__(self, path=":memory:", threshold=0.8, num_perm=128, bands=32):
+        assert num_perm % bands == 0, "num_perm must be divisible by bands."
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm)
+        self.cache = ResultCache(path)
+        # share the connection of the result cache, so ":memory:" indexes keep both tables
+        self._lock = self.cache._lock
+        self._conn = self.cache._conn
+        self._conn.execute("CREATE TABLE IF NOT EXISTS records (key TEXT PRIMARY KEY, cluster TEXT, signature BLOB)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS buckets (band INTEGER, bucket TEXT, key TEXT)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS buckets_idx ON buckets (band, bucket)")
+        self._conn.commit()
+
+    def _band_buckets(self, signature):
+        return [
+            (band, hashlib.sha1(signature[band * self.rows:(band + 1) * self.rows].tobytes()).hexdigest())
+            for band in range(self.bands)
+        ]
+
+    def _find_near_duplicate(self, signature, buckets):
+        candidates = set()
+        for band, bucket in buckets:
+            rows = self._conn.execute("SELECT key FROM buckets WHERE band = ? AND bucket = ?", (band, bucket)).fetchall()
+            candidates.update(key for key, in rows)
+        best_cluster, best_similarity = None, self.threshold
+        for key in candidates:
+            cluster, other = self._conn.execute("SELECT cluster, signature FROM records WHERE key = ?", (key,)).fetchone()
+            similarity = float(np.mean(np.frombuffer(other, dtype=np.uint32) == signature))
+            if similarity >= best_similarity:
+                best_cluster, best_similarity = cluster, similarity
+        return best_cluster
+
+    def assign(self, texts):
+        """
+        Add texts to the index and return their cluster IDs.
+
+        Args:
+            texts (list[str]): Record texts, e.g. title and abstract.
+        Returns:
+            list[str]: The cluster ID of every text, equal for duplicates.
+        """
+        clusters = []
+        with self._lock:
+            for text in texts:
+                key = exact_hash(text)
+                row = self._conn.execute("SELECT cluster FROM records WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    clusters.append(row[0])
+                    continue
+                signature = self.hasher.signature(text)
+                buckets = self._band_buckets(signature)
+                cluster = self._find_near_duplicate(signature, buckets) or key
+                self._conn.execute("INSERT INTO records (key, cluster, signature) VALUES (?, ?, ?)", (key, cluster, signature.tobytes()))
+                self._conn.executemany("INSERT INTO buckets (band, bucket, key) VALUES (?, ?, ?)", [(b, h, key) for b, h in buckets])
+                clusters.append(cluster)
+            self._conn.commit()
+        return clusters
+
+
+def is_failed_result(result):
+    """Whether a result of a batch task holds no prediction, e.g. the fallback of a failed or unparsable output."""
+    from .modules.screening import NO_PREDICTION_RATIONALE
+
+    if isinstance(result, tuple) and len(result) == 2 and isinstance(result[0], list):
+        # screening (evaluations, score)
+        return all(evaluation.get("rationale") == NO_PREDICTION_RATIONALE for evaluation in result[0])
+    if isinstance(result, dict) and isinstance(result.get("fields"), list):
+        return all(is_empty_value(field.get("value")) for field in result["fields"] if isinstance(field, dict))
+    if isinstance(result, dict):
+        return all(is_empty_value(value) or value == [] for value in result.values())
+    return result is None or result == []
+
+
+def dedup_batch_run(batch_fn, paper_contents, index=None, model=None, **kwargs):
+    """
+    Run a batch task only once per duplicate cluster and fan the results out to all duplicates.
+
+    Results of clusters already processed with the same task arguments and model, in this or
+    an earlier run on the same index, are reused without inference. Failed or empty results
+    (see `is_failed_result`) are returned but not cached.
+
+    Args:
+        batch_fn (callable): A batch function from `leads.api`, e.g. `batch_screening_study`.
+        paper_contents (list): A list of paper contents.
+        index (DedupIndex): The dedup index, a temporary in-memory one is used if None.
+        model (str): ID of the model, part of the cache key. Defaults to the `cache_id` of the backend in use.
+        **kwargs: Extra arguments passed to `batch_fn`, e.g. the PICO elements.
+    Returns:
+        list: The results of `batch_fn`, one per paper content.
+    """
+    if kwargs.get("return_label_matrix"):
+        raise ValueError("dedup_batch_run needs one result per paper, return_label_matrix is not supported.")
+    index = index if index is not None else DedupIndex()
+    model = model if model is not None else get_backend().cache_id()
+    task = task_key(batch_fn.__name__, model=model, **kwargs)
+    clusters = index.assign(paper_contents)
+    results = index.cache.get_many(clusters, task)
+
+    # one representative paper per cluster that has no cached result yet
+    pending = {}
+    for cluster, paper_content in zip(clusters, paper_contents):
+        if cluster not in results and cluster not in pending:
+            pending[cluster] = paper_content
+    if pending:
+        new_results = dict(zip(pending.keys(), batch_fn(list(pending.values()), **kwargs)))
+        index.cache.put_many({cluster: result for cluster, result in new_results.items() if not is_failed_result(result)}, task)
+        results.update(new_results)
+    return [results[cluster] for cluster in clusters]
@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import datetime
+
+from .cache import ResultCache
+from .pipeline import async_review_pipeline
+from .pubmed import ESEARCH_MAX_RESULTS, search_pubmed, fetch_pubmed_abstracts
+from .ctgov import search_ctgov
+
+PICO_NAMES = ["population", "intervention", "comparison", "outcome"]
+
+
+def _fetch_pubmed(query, since, max_records):
+    limit = ESEARCH_MAX_RESULTS if max_records is None else min(max_records, ESEARCH_MAX_RESULTS)
+    # "mdat" also covers articles corrected or updated after they were added
+    pmids = search_pubmed(query, retmax=limit, mindate=since, datetype="mdat")
+    return fetch_pubmed_abstracts(pmids), len(pmids) >= limit
+
+
+def _fetch_ctgov(query, since, max_records):
+    records = search_ctgov(query, max_records=max_records, last_update_from=since)
+    return records, max_records is not None and len(records) >= max_records
+
+
+# source name -> function of (query, since date or None, max records) returning the record dicts
+# and whether the search may be truncated
+SOURCES = {
+    "pubmed": _fetch_pubmed,
+    "ctgov": _fetch_ctgov,
+}
+
+
+def _content_hash(paper_content):
+    return hashlib.sha1(paper_content.encode("utf-8")).hexdigest()
+
+
+class LivingReview:
+    """
+    A systematic review kept up to date by incremental runs.
+
+    The PICO, the search queries, the fetched record IDs and the screening and extraction
+    results are stored in SQLite. Each `update` only fetches the records added or updated
+    since the previous run (the watermark), and only screens and extracts the new records
+    and those whose content changed.
+
+    Args:
+        path (str): Path of the SQLite file of the review.
+        population (str): The population of the research, only needed on the first run.
+        intervention (str): The intervention of the research
+        comparison (str): The comparison of the research
+        outcome (str): The outcome of the research
+    """
+
+    def __init__(self, path, population=None, intervention=None, comparison=None, outcome=None):
+        self.store = ResultCache(path)
+        self.state = self.store.get_many(["state"], "review").get("state") or {"pico": None, "queries": None, "watermark": None}
+        pico = {"population": population, "intervention": intervention, "comparison": comparison, "outcome": outcome}
+        if any(pico.values()):
+            if self.state["pico"] is not None and self.state["pico"] != pico:
+                raise ValueError(f"The review at {path} was created for a different PICO: {self.state['pico']}")
+            self.state["pico"] = pico
+        assert self.state["pico"] is not None, "At least one of population, intervention, comparison, or outcome must be provided for a new review."
+
+    def _save_state(self):
+        self.store.put_many({"state": self.state}, "review")
+
+    def update(self, sources=("pubmed", "ctgov"), max_records=None, extract_fn=None, extract_kwargs=None,
+               include_fn=None, regenerate_queries=False, **pipeline_kwargs):
+        """
+        Fetch, screen and extract the records added or updated since the last run.
+
+        Args:
+            sources (list[str]): Names of the `SOURCES` to search.
+            max_records (int): Max number of records per sub-query and source, None to fetch all of them.
+                If a source returns that many records, or PubMed returns its max of
+                `ESEARCH_MAX_RESULTS`, the search may be truncated, so the watermark is not
+                moved and the next run fetches the same period again.
+            extract_fn (callable): Optional `batch_extract_*` function run on the included records.
+            extract_kwargs (dict): Extra arguments of `extract_fn`.
+            include_fn (callable): Takes (evaluations, score) and returns whether the record is included.
+            regenerate_queries (bool): Generate new queries instead of reusing the stored ones.
+                The whole search is then run again, without the watermark.
+            **pipeline_kwargs: Other arguments of `async_review_pipeline`, e.g. the concurrency.
+        Returns:
+            dict: With "new", "updated" (record IDs screened in this run), "extracted", "watermark",
+                "truncated" (the (source, query) pairs that hit `max_records` or the PubMed max)
+                and "errors" keys.
+                After errors, the watermark is not moved and the records whose screening or
+                extraction failed are not stored, so the next run processes them again.
+        """
+        run_date = datetime.date.today().isoformat()
+        queries = None if regenerate_queries else self.state["queries"]
+        since = self.state["watermark"] if queries is not None else None
+        known = self.store.items("records")
+        truncated = []
+
+        def fetch_fn(query):
+            changed = []
+            for source in sources:
+                source_records, is_truncated = SOURCES[source](query, since, max_records)
+                if is_truncated:
+                    truncated.append((source, query))
+                for record in source_records:
+                    digest = _content_hash(record["paper_content"])
+                    # date filters are day-granular, so records of the last run day come back again
+                    if known.get(record["id"], {}).get("hash") == digest:
+                        continue
+                    changed.append({**record, "source": source, "hash": digest})
+            return changed
+
+        output = asyncio.run(async_review_pipeline(
+            **self.state["pico"], queries=queries, fetch_fn=fetch_fn, extract_fn=extract_fn,
+            extract_kwargs=extract_kwargs, include_fn=include_fn, **pipeline_kwargs,
+        ))
+
+        failed = {record_id for error in output["errors"] for record_id in error.get("ids", [])}
+        records = {record_id: r for record_id, r in output["records"].items() if record_id not in failed}
+        self.store.put_many({
+            record_id: {"source": r["source"], "hash": r["hash"], "title": r.get("title"), "last_update": r.get("last_update") or run_date}
+            for record_id, r in records.items()
+        }, "records")
+        self.store.put_many({record_id: output["screening"][record_id] for record_id in records}, "screening")
+        # drop the stale extraction of updated records that are no longer included
+        self.store.put_many({record_id: output["extraction"].get(record_id) for record_id in records}, "extraction")
+
+        self.state["queries"] = output["queries"]
+        if not truncated and not output["errors"]:
+            self.state["watermark"] = run_date
+        self._save_state()
+        return {
+            "new": [record_id for record_id in records if record_id not in known],
+            "updated": [record_id for record_id in records if record_id in known],
+            "extracted": list(output["extraction"]),
+            "watermark": self.state["watermark"],
+            "truncated": truncated,
+            "errors": output["errors"],
+        }
+
+    def results(self):
+        """
+        Return the accumulated state of the review.
+
+        Returns:
+            dict: With "pico", "queries", "watermark", "records" (id -> metadata),
+                "screening" (id -> (evaluations, score)) and "extraction" (id -> result) keys.
+        """
+        return {
+            **self.state,
+            "records": self.store.items("records"),
+            "screening": self.store.items("screening"),
+            "extraction": {k: v for k, v in self.store.items("extraction").items() if v is not None},
+        }
+
+    def close(self):
+        self.store.close()
@@ -28,19 +28,12 @@ Format:
 
 import json
 import re
-import pdb
 import os
-import tiktoken
 from ..client import call_leads
+from ..chunking import truncate_paper_content, map_reduce_chunks, is_empty_value
 
+ARM_DESIGN_QUERY = "arm arms group groups intervention interventions placebo control comparator dose randomized randomly assigned allocated treatment regimen"
 
-def cut_paper_content(paper_content, max_tokens=29_000):
-    encoding = tiktoken.get_encoding("cl100k_base")
-    tokens = encoding.encode(paper_content)
-    if len(tokens) > max_tokens:
-        tokens = tokens[:max_tokens]
-        paper_content = encoding.decode(tokens)
-    return paper_content
 
 def parse_llm_output(llm_output):
     """Parse LLM output to extract list of dictionaries with arm label, type, description, and intervention names.
@@ -76,26 +69,74 @@ def parse_llm_output(llm_output):
     
     return results
 
-def extract_arm_design(paper_content):
-    paper_content = cut_paper_content(paper_content)
+def merge_arms(chunk_results):
+    """Merge the arms extracted from the chunks of a paper.
+
+    Arms with the same label (case-insensitive) are merged: the first non-empty type is kept,
+    the longest description is kept, and the intervention names are united in order of appearance.
+    """
+    merged = {}
+    for result in chunk_results:
+        arms = result.get("arms", []) if isinstance(result, dict) else result
+        for arm in arms if isinstance(arms, list) else []:
+            if not isinstance(arm, dict) or is_empty_value(arm.get("label")):
+                continue
+            key = str(arm["label"]).strip().lower()
+            if key not in merged:
+                merged[key] = {"label": arm["label"], "type": arm.get("type"), "description": arm.get("description"), "interventionNames": []}
+            current = merged[key]
+            if is_empty_value(current["type"]) and not is_empty_value(arm.get("type")):
+                current["type"] = arm["type"]
+            if len(str(arm.get("description") or "")) > len(str(current["description"] or "")):
+                current["description"] = arm["description"]
+            for name in arm.get("interventionNames") or []:
+                if name not in current["interventionNames"]:
+                    current["interventionNames"].append(name)
+    return list(merged.values())
+
+def extract_arm_design(paper_content, max_content_tokens=29_000, smart_truncation=True, map_reduce=False, chunk_tokens=8_000, chunk_overlap=500, max_tokens=None):
+    if map_reduce:
+        # extract from overlapping chunks of the whole paper instead of truncating it
+        return batch_extract_arm_design([paper_content], map_reduce=True, chunk_tokens=chunk_tokens, chunk_overlap=chunk_overlap, max_tokens=max_tokens)[0]
+    # keep the sections describing the arms, e.g. the methods
+    query = ARM_DESIGN_QUERY if smart_truncation else None
+    paper_content = truncate_paper_content(paper_content, query, max_content_tokens)
     prompt = ARM_DESIGN_EXTRACTION_PROMPT_TEMPLATE.format(paper_content=paper_content)
     results = call_leads(prompt,
         endpoint=os.getenv("LEADS_ENDPOINT", "http://localhost:13141/v1"), 
         api_key=os.getenv("LEADS_API_KEY", "testtoken"), 
         temperature=0.1, 
-        max_tokens=1024)
+        max_tokens=max_tokens,
+        task="arm_design")
     results = parse_llm_output(results)
     return results
 
-def batch_extract_arm_design(paper_contents):
-    paper_contents = [cut_paper_content(paper_content) for paper_content in paper_contents]
+def batch_extract_arm_design(paper_contents, max_content_tokens=29_000, smart_truncation=True, map_reduce=False, chunk_tokens=8_000, chunk_overlap=500, max_tokens=None, batch_size=20):
+    if map_reduce:
+        return map_reduce_chunks(
+            paper_contents,
+            lambda chunk: ARM_DESIGN_EXTRACTION_PROMPT_TEMPLATE.format(paper_content=chunk),
+            merge_arms,
+            parse_fn=parse_llm_output,
+            chunk_tokens=chunk_tokens,
+            overlap_tokens=chunk_overlap,
+            batch_size=batch_size,
+            endpoint=os.getenv("LEADS_ENDPOINT", "http://localhost:13141/v1"),
+            api_key=os.getenv("LEADS_API_KEY", "testtoken"),
+            temperature=0.1,
+            max_tokens=max_tokens,
+            task="arm_design"
+        )
+    query = ARM_DESIGN_QUERY if smart_truncation else None
+    paper_contents = [truncate_paper_content(paper_content, query, max_content_tokens) for paper_content in paper_contents]
     prompts = [ARM_DESIGN_EXTRACTION_PROMPT_TEMPLATE.format(paper_content=paper_content) for paper_content in paper_contents]
     results = call_leads(
         prompts,
         endpoint=os.getenv("LEADS_ENDPOINT", "http://localhost:13141/v1"), 
         api_key=os.getenv("LEADS_API_KEY", "testtoken"), 
         temperature=0.1, 
-        max_tokens=1024
+        max_tokens=max_tokens,
+        task="arm_design"
         )
     results = [parse_llm_output(result) for result in results]
     return results
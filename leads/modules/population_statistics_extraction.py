@@ -39,19 +39,9 @@ Format:
 
 import json
 import re
-import pdb
 import os
-import tiktoken
 from ..client import call_leads
-
-def cut_paper_content(paper_content, max_tokens=29_000):
-    encoding = tiktoken.get_encoding("cl100k_base")
-    tokens = encoding.encode(paper_content)
-    if len(tokens) > max_tokens:
-        tokens = tokens[:max_tokens]
-        paper_content = encoding.decode(tokens)
-    return paper_content
-
+from ..chunking import truncate_paper_content
 
 def parse_llm_output(llm_output):
     """Parse LLM output to extract structured data with flexible formats.
@@ -117,27 +107,32 @@ def parse_llm_output(llm_output):
     
     return {"results": []}
 
-def extract_population_statistics(paper_content, measureDef, paramType, unitOfMeasure, groupDef):
-    paper_content = cut_paper_content(paper_content)
+def extract_population_statistics(paper_content, measureDef, paramType, unitOfMeasure, groupDef, max_content_tokens=29_000, smart_truncation=True, max_tokens=None):
+    # keep the sections relevant to the measure and groups, e.g. the baseline characteristics table
+    query = f"{measureDef} {paramType} {unitOfMeasure} {groupDef}" if smart_truncation else None
+    paper_content = truncate_paper_content(paper_content, query, max_content_tokens)
     prompt = PARTICIPANT_EXTRACTION_PROMPT_TEMPLATE.format(paper_content=paper_content, measureDef=measureDef, paramType=paramType, unitOfMeasure=unitOfMeasure, groupDef=groupDef)
     results = call_leads(prompt,
         endpoint=os.getenv("LEADS_ENDPOINT", "http://localhost:13141/v1"), 
         api_key=os.getenv("LEADS_API_KEY", "testtoken"), 
         temperature=0.1, 
-        max_tokens=1024
+        max_tokens=max_tokens,
+        task="population_statistics"
     )
     results = parse_llm_output(results)
     return results
 
-def batch_extract_population_statistics(paper_contents, measureDef, paramType, unitOfMeasure, groupDef):
-    paper_contents = [cut_paper_content(paper_content) for paper_content in paper_contents]
+def batch_extract_population_statistics(paper_contents, measureDef, paramType, unitOfMeasure, groupDef, max_content_tokens=29_000, smart_truncation=True, max_tokens=None):
+    query = f"{measureDef} {paramType} {unitOfMeasure} {groupDef}" if smart_truncation else None
+    paper_contents = [truncate_paper_content(paper_content, query, max_content_tokens) for paper_content in paper_contents]
     prompts = [PARTICIPANT_EXTRACTION_PROMPT_TEMPLATE.format(paper_content=paper_content, measureDef=measureDef, paramType=paramType, unitOfMeasure=unitOfMeasure, groupDef=groupDef) for paper_content in paper_contents]
     results = call_leads(
         prompts,
         endpoint=os.getenv("LEADS_ENDPOINT", "http://localhost:13141/v1"), 
         api_key=os.getenv("LEADS_API_KEY", "testtoken"), 
         temperature=0.1, 
-        max_tokens=1024
+        max_tokens=max_tokens,
+        task="population_statistics"
     )
     results = [parse_llm_output(result) for result in results]
     return results
\ No newline at end of file
@@ -50,20 +50,16 @@ For example:
 ```
 """
 
-import pdb
 import os
 import re
 import json
-from ..client import call_leads
-import tiktoken
+import hashlib
+from ..client import call_leads, get_backend
+from ..cache import ResultCache, task_key
+from ..chunking import cut_paper_content
 
-def cut_paper_content(paper_content, max_tokens=29_000):
-    encoding = tiktoken.get_encoding("cl100k_base")
-    tokens = encoding.encode(paper_content)
-    if len(tokens) > max_tokens:
-        tokens = tokens[:max_tokens]
-        paper_content = encoding.decode(tokens)
-    return paper_content
+# rationale of the UNCERTAIN evaluations filled in when an output has no parsable prediction
+NO_PREDICTION_RATIONALE = "No eligibility predictions found in the text."
 
 def extract_json_from_llm_output(text):
     """Extract eligibility predictions from LLM output text, with multiple fallback methods."""
@@ -160,7 +156,97 @@ def get_score(evaluations):
             score -= 1
     return score / len(evaluations)
 
-def screening_study(paper_content, population=None, intervention=None, comparison=None, outcome=None):
+VOTE_LABELS = ["YES", "PARTIAL", "NO", "UNCERTAIN"]
+
+def vote_evaluations(sampled_evaluations, num_criteria):
+    """
+    Aggregate the evaluations of several sampled completions by majority vote per criterion.
+
+    Args:
+        sampled_evaluations (list): The evaluations parsed from each completion.
+        num_criteria (int): Number of criteria.
+    Returns:
+        list: One evaluation per criterion, with the majority eligibility, the rationale of the first
+            agreeing sample, and the share of the samples that voted for it as "confidence".
+            A tie between the most voted labels gives UNCERTAIN, so a split vote never counts
+            toward inclusion.
+    """
+    evaluations = []
+    for i in range(num_criteria):
+        votes = [sample[i] for sample in sampled_evaluations if len(sample) > i and sample[i].get('eligibility') in VOTE_LABELS]
+        if not votes:
+            evaluations.append({"eligibility": "UNCERTAIN", "rationale": NO_PREDICTION_RATIONALE, "confidence": 0.0})
+            continue
+        counts = {label: sum(v['eligibility'] == label for v in votes) for label in VOTE_LABELS}
+        top = [label for label in VOTE_LABELS if counts[label] == max(counts.values())]
+        label = top[0] if len(top) == 1 else "UNCERTAIN"
+        if counts[label]:
+            rationale = next(v.get('rationale', "") for v in votes if v['eligibility'] == label)
+        else:
+            rationale = f"The sampled evaluations are split between {' and '.join(top)}."
+        evaluations.append({"eligibility": label, "rationale": rationale, "confidence": counts[label] / len(sampled_evaluations)})
+    return evaluations
+
+def screen_by_criterion(paper_contents, criteria, cache, num_samples=1, sample_temperature=0.7, max_tokens=None, model=None):
+    """
+    Evaluate each criterion in its own prompt, reusing the cached decisions of (paper, criterion) pairs.
+
+    When one criterion of the protocol changes, only that criterion is evaluated again. Each
+    criterion costs one prompt per paper, so this only pays off with a cache kept between runs.
+    Outputs without any parsed prediction (e.g. failed requests) are returned as UNCERTAIN but
+    not cached, so they are evaluated again on the next run.
+
+    Args:
+        paper_contents (list): A list of (truncated) paper contents.
+        criteria (list[str]): The criteria, see `get_eligibility_criteria`.
+        cache (ResultCache or str): The cache of the decisions, or the path of its SQLite file.
+        num_samples (int): If > 1, sample this many completions per prompt and take the majority vote.
+        sample_temperature (float): The temperature used when num_samples > 1.
+        max_tokens (int): Max number of generated tokens per prompt, None to use the budget learned from earlier calls.
+        model (str): ID of the model, part of the cache key. Defaults to the `cache_id` of the backend in use.
+    Returns:
+        list: The evaluations of each paper, one per criterion.
+    """
+    if cache is None:
+        raise ValueError("Per-criterion screening needs a cache kept between runs, pass a ResultCache or the path of its SQLite file.")
+    cache = ResultCache(cache) if isinstance(cache, str) else cache
+    records = [hashlib.sha1(paper_content.encode("utf-8")).hexdigest() for paper_content in paper_contents]
+    model = model if model is not None else get_backend().cache_id()
+    tasks = [task_key("screening_criterion", criterion=criterion, num_samples=num_samples, model=model) for criterion in criteria]
+    cached = [cache.get_many(records, task) for task in tasks]
+
+    # prompts of the (paper, criterion) pairs missing from the cache, once per distinct paper
+    pending = {}
+    for record, paper_content in zip(records, paper_contents):
+        for j, criterion in enumerate(criteria):
+            if record not in cached[j] and (record, j) not in pending:
+                pending[(record, j)] = SCREENING_PROMPT_TEMPLATE.format(paper_content=paper_content, num_criteria=1, criteria_text=stringfy_criteria([criterion]))
+    if pending:
+        results = call_leads(
+            list(pending.values()),
+            endpoint=os.getenv("LEADS_ENDPOINT", "http://localhost:13141/v1"),
+            api_key=os.getenv("LEADS_API_KEY", "testtoken"),
+            temperature=0.1 if num_samples == 1 else sample_temperature,
+            max_tokens=max_tokens,
+            n=num_samples,
+            task="screening_criterion"
+        )
+        new_results = [{} for _ in criteria]
+        for (record, j), result in zip(pending.keys(), results):
+            samples = result if num_samples > 1 else [result]
+            sampled_evaluations = [extract_json_from_llm_output(r).get('evaluations', []) for r in samples]
+            evaluation = vote_evaluations(sampled_evaluations, 1)[0]
+            if num_samples == 1:
+                evaluation.pop("confidence")
+            cached[j][record] = evaluation
+            if any(sampled_evaluations):
+                new_results[j][record] = evaluation
+        for j, task in enumerate(tasks):
+            if new_results[j]:
+                cache.put_many(new_results[j], task)
+    return [[cached[j][record] for j in range(len(criteria))] for record in records]
+
+def screening_study(paper_content, population=None, intervention=None, comparison=None, outcome=None, num_samples=1, sample_temperature=0.7, per_criterion=False, cache=None, max_content_tokens=29_000, max_tokens=None):
     """
     Perform screening study on a given paper content.
 
@@ -170,7 +256,17 @@ def screening_study(paper_content, population=None, intervention=None, compariso
         intervention (str): The intervention of the research
         comparison (str): The comparison of the research
         outcome (str): The outcome of the research
+        num_samples (int): If > 1, sample this many completions in one request and take the majority vote per criterion.
+        sample_temperature (float): The temperature used when num_samples > 1.
+        per_criterion (bool): If True, evaluate each criterion separately and reuse cached decisions, see `screen_by_criterion`.
+        cache (ResultCache or str): The cache of the per-criterion decisions, or the path of its SQLite file. Required with per_criterion.
+        max_content_tokens (int): The paper is truncated to this many tokens.
+        max_tokens (int): Max number of generated tokens, None to use the budget learned from earlier calls.
     """
+    if per_criterion:
+        return batch_screening_study([paper_content], population, intervention, comparison, outcome, num_samples=num_samples,
+                                     sample_temperature=sample_temperature, per_criterion=True, cache=cache,
+                                     max_content_tokens=max_content_tokens, max_tokens=max_tokens)[0]
     assert population or intervention or comparison or outcome, "At least one of population, intervention, comparison, or outcome must be provided."
     PICO = {
         "P": population if population else "",
@@ -180,25 +276,30 @@ def screening_study(paper_content, population=None, intervention=None, compariso
     }
     criteria, num_criteria = get_eligibility_criteria(PICO)
     criteria_text = stringfy_criteria(criteria)
-    paper_content = cut_paper_content(paper_content)
+    paper_content = cut_paper_content(paper_content, max_content_tokens)
     prompt = SCREENING_PROMPT_TEMPLATE.format(paper_content=paper_content, num_criteria=num_criteria, criteria_text=criteria_text)
     results = call_leads(
         prompt, 
         endpoint=os.getenv("LEADS_ENDPOINT", "http://localhost:13141/v1"), 
         api_key=os.getenv("LEADS_API_KEY", "testtoken"),
-        temperature=0.1,
-        max_tokens=1024
+        temperature=0.1 if num_samples == 1 else sample_temperature,
+        max_tokens=max_tokens,
+        n=num_samples,
+        task="screening"
     )
+    if num_samples > 1:
+        evaluations = vote_evaluations([extract_json_from_llm_output(result).get('evaluations', []) for result in results], num_criteria)
+        return evaluations, get_score(evaluations)
     # parse the results
     evaluations = extract_json_from_llm_output(results)
     evaluations = evaluations.get('evaluations', [])
     if len(evaluations) == 0:
         # make uncertain for all criteria
-        evaluations = [{"eligibility": "UNCERTAIN", "rationale": "No eligibility predictions found in the text."} for _ in range(num_criteria)]
+        evaluations = [{"eligibility": "UNCERTAIN", "rationale": NO_PREDICTION_RATIONALE} for _ in range(num_criteria)]
     score = get_score(evaluations)
     return evaluations, score
 
-def batch_screening_study(paper_contents, population=None, intervention=None, comparison=None, outcome=None):
+def batch_screening_study(paper_contents, population=None, intervention=None, comparison=None, outcome=None, return_label_matrix=False, num_samples=1, sample_temperature=0.7, per_criterion=False, cache=None, max_content_tokens=29_000, max_tokens=None):
     """
     Perform screening study on a list of paper contents.
 
@@ -208,6 +309,15 @@ def batch_screening_study(paper_contents, population=None, intervention=None, co
         intervention (str): The intervention of the research
         comparison (str): The comparison of the research
         outcome (str): The outcome of the research
+        return_label_matrix (bool): If True, return the results as a (labels, scores) pair of NumPy arrays,
+            see `leads.screening_matrix.to_label_matrix`.
+        num_samples (int): If > 1, sample this many completions in one request per paper and take the majority vote per criterion.
+        sample_temperature (float): The temperature used when num_samples > 1.
+        per_criterion (bool): If True, evaluate each criterion separately and reuse cached decisions, see `screen_by_criterion`.
+        cache (ResultCache or str): The cache of the per-criterion decisions shared between runs of a review,
+            or the path of its SQLite file. Required with per_criterion.
+        max_content_tokens (int): The papers are truncated to this many tokens.
+        max_tokens (int): Max number of generated tokens per paper, None to use the budget learned from earlier calls.
     Returns:
         list: A list of screening results.
     """
@@ -220,18 +330,36 @@ def batch_screening_study(paper_contents, population=None, intervention=None, co
     }
     criteria, num_criteria = get_eligibility_criteria(PICO)
     criteria_text = stringfy_criteria(criteria)
-    paper_contents = [cut_paper_content(paper_content) for paper_content in paper_contents]
+    paper_contents = [cut_paper_content(paper_content, max_content_tokens) for paper_content in paper_contents]
+    if per_criterion:
+        evaluations = screen_by_criterion(paper_contents, criteria, cache, num_samples, sample_temperature, max_tokens)
+        if return_label_matrix:
+            from ..screening_matrix import to_label_matrix, score_label_matrix
+            labels = to_label_matrix(evaluations, num_criteria)
+            return labels, score_label_matrix(labels)
+        return [(eval, get_score(eval)) for eval in evaluations]
     prompts = [SCREENING_PROMPT_TEMPLATE.format(paper_content=paper_content, num_criteria=num_criteria, criteria_text=criteria_text) for paper_content in paper_contents]
     results = call_leads(
         prompts, 
         endpoint=os.getenv("LEADS_ENDPOINT", "http://localhost:13141/v1"), 
         api_key=os.getenv("LEADS_API_KEY", "testtoken"),
-        temperature=0.1,
-        max_tokens=1024
+        temperature=0.1 if num_samples == 1 else sample_temperature,
+        max_tokens=max_tokens,
+        n=num_samples,
+        task="screening"
     )
     # parse the results
-    evaluations = [extract_json_from_llm_output(result) for result in results]
-    evaluations = [eval.get('evaluations', []) for eval in evaluations]
+    if num_samples > 1:
+        evaluations = [vote_evaluations([extract_json_from_llm_output(r).get('evaluations', []) for r in result], num_criteria) for result in results]
+    else:
+        evaluations = [extract_json_from_llm_output(result) for result in results]
+        evaluations = [eval.get('evaluations', []) for eval in evaluations]
+    # make uncertain for all criteria when no predictions are found
+    evaluations = [eval if len(eval) > 0 else [{"eligibility": "UNCERTAIN", "rationale": NO_PREDICTION_RATIONALE} for _ in range(num_criteria)] for eval in evaluations]
+    if return_label_matrix:
+        from ..screening_matrix import to_label_matrix, score_label_matrix
+        labels = to_label_matrix(evaluations, num_criteria)
+        return labels, score_label_matrix(labels)
     scores = [get_score(eval) for eval in evaluations]
     tuple_results = list(zip(evaluations, scores))
     return tuple_results
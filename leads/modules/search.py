@@ -19,93 +19,93 @@ Your output should be in the following JSON format:
 }}
 """
 
-import pdb
 import os
 import json
 import re
 from ..client import call_leads
 
-def split_medical_query(query):
-    """Split a complex medical query into manageable segments while preserving its logical structure."""
-    
-    # First, identify the main AND parts
-    def split_on_main_and(query):
-        # Find the main AND that separates the two major groups
-        parts = []
-        current_part = ""
-        paren_count = 0
-        i = 0
-        
-        while i < len(query):
-            if query[i] == '(':
-                paren_count += 1
-                current_part += query[i]
-            elif query[i] == ')':
-                paren_count -= 1
-                current_part += query[i]
-            # Look for " AND " at the top level (when paren_count == 0)
-            elif (paren_count == 0 and 
-                  i + 5 < len(query) and 
-                  query[i:i+5] == " AND "):
-                parts.append(current_part.strip())
-                current_part = ""
-                i += 4  # Skip "AND"
-            else:
-                current_part += query[i]
-            i += 1
-            
-        if current_part.strip():
+def split_on_main_and(query):
+    """Split a query on its top-level AND operators"""
+    # Find the main AND that separates the two major groups
+    parts = []
+    current_part = ""
+    paren_count = 0
+    i = 0
+
+    while i < len(query):
+        if query[i] == '(':
+            paren_count += 1
+            current_part += query[i]
+        elif query[i] == ')':
+            paren_count -= 1
+            current_part += query[i]
+        # Look for " AND " at the top level (when paren_count == 0)
+        elif (paren_count == 0 and 
+              i + 5 < len(query) and 
+              query[i:i+5] == " AND "):
             parts.append(current_part.strip())
-        return parts
-
-    def split_or_group(group, max_terms=5):
-        """Split a group of OR terms into smaller subgroups"""
-        # Remove outer parentheses
-        group = group.strip()
-        if group.startswith('(') and group.endswith(')'):
-            group = group[1:-1].strip()
-            
-        terms = []
-        current_term = ""
-        paren_count = 0
-        i = 0
-        
-        while i < len(group):
-            if group[i] == '(':
-                paren_count += 1
-                current_term += group[i]
-            elif group[i] == ')':
-                paren_count -= 1
-                current_term += group[i]
-            # Look for " OR " at the top level
-            elif (paren_count == 0 and 
-                  i + 4 < len(group) and 
-                  group[i:i+4] == " OR "):
-                terms.append(current_term.strip())
-                current_term = ""
-                i += 3  # Skip "OR"
-            else:
-                current_term += group[i]
-            i += 1
-            
-        if current_term.strip():
+            current_part = ""
+            i += 4  # Skip "AND"
+        else:
+            current_part += query[i]
+        i += 1
+
+    if current_part.strip():
+        parts.append(current_part.strip())
+    return parts
+
+def split_or_group(group, max_terms=5):
+    """Split a group of OR terms into smaller subgroups"""
+    # Remove outer parentheses
+    group = group.strip()
+    if group.startswith('(') and group.endswith(')'):
+        group = group[1:-1].strip()
+
+    terms = []
+    current_term = ""
+    paren_count = 0
+    i = 0
+
+    while i < len(group):
+        if group[i] == '(':
+            paren_count += 1
+            current_term += group[i]
+        elif group[i] == ')':
+            paren_count -= 1
+            current_term += group[i]
+        # Look for " OR " at the top level
+        elif (paren_count == 0 and 
+              i + 4 < len(group) and 
+              group[i:i+4] == " OR "):
             terms.append(current_term.strip())
-            
-        # Split into subgroups
-        subgroups = []
-        current_subgroup = []
-        
-        for term in terms:
-            current_subgroup.append(term)
-            if len(current_subgroup) >= max_terms:
-                subgroups.append(current_subgroup)
-                current_subgroup = []
-                
-        if current_subgroup:
+            current_term = ""
+            i += 3  # Skip "OR"
+        else:
+            current_term += group[i]
+        i += 1
+
+    if current_term.strip():
+        terms.append(current_term.strip())
+
+    # Split into subgroups
+    subgroups = []
+    current_subgroup = []
+
+    for term in terms:
+        current_subgroup.append(term)
+        if len(current_subgroup) >= max_terms:
             subgroups.append(current_subgroup)
-            
-        return subgroups
+            current_subgroup = []
 
+    if current_subgroup:
+        subgroups.append(current_subgroup)
+
+    return subgroups
+
+
+def split_medical_query(query):
+    """Split a complex medical query into manageable segments while preserving its logical structure."""
+    
     def construct_subqueries(condition_groups, intervention_groups):
         """Construct valid subqueries from combinations of condition and intervention groups"""
         subqueries = []
@@ -163,7 +163,39 @@ def parse_search_query(response):
         # If all else fails, return the original response
         return response
 
-def search_query_generation(population=None, intervention=None, comparison=None, outcome=None):
+def merge_search_queries(queries, min_votes=1):
+    """
+    Merge several sampled search queries into one, ranking the terms of each part by the number of queries using them.
+
+    Args:
+        queries (list[str]): The parsed queries, each of the form "(conditions) AND (interventions)".
+        min_votes (int): Min number of queries a term must appear in to be kept.
+    Returns:
+        str: The merged query, or the first query if none of them has two main parts.
+    """
+    votes = [{}, {}]
+    for query in queries:
+        main_parts = split_on_main_and(query)
+        if len(main_parts) != 2:
+            continue
+        for part_votes, part in zip(votes, main_parts):
+            terms = [term for group in split_or_group(part, max_terms=len(part) + 1) for term in group]
+            # count each term once per query
+            for term in {term.lower(): term for term in terms}.values():
+                key = term.lower()
+                count, first_term, order = part_votes.get(key, (0, term, len(part_votes)))
+                part_votes[key] = (count + 1, first_term, order)
+    if not votes[0] or not votes[1]:
+        return queries[0] if queries else ""
+    merged_parts = []
+    for part_votes in votes:
+        ranked = sorted(part_votes.values(), key=lambda v: (-v[0], v[2]))
+        # never drop all terms of a part
+        terms = [term for count, term, _ in ranked if count >= min_votes] or [ranked[0][1]]
+        merged_parts.append(f"({' OR '.join(terms)})")
+    return " AND ".join(merged_parts)
+
+def search_query_generation(population=None, intervention=None, comparison=None, outcome=None, num_samples=1, min_votes=1):
     """
     Generate a search query for a given PICO elements.
 
@@ -172,15 +204,20 @@ def search_query_generation(population=None, intervention=None, comparison=None,
         intervention (str): The intervention of the research
         comparison (str): The comparison of the research
         outcome (str): The outcome of the research
+        num_samples (int): If > 1, sample this many queries in one request and merge their terms, see `merge_search_queries`.
+        min_votes (int): Min number of sampled queries a term must appear in when num_samples > 1.
     """
     assert population or intervention or comparison or outcome, "At least one of population, intervention, comparison, or outcome must be provided."
     prompt = SEARCH_PROMPT_TEMPLATE.format(P=population, I=intervention, C=comparison, O=outcome)
-    response = call_leads(prompt, endpoint=os.getenv("LEADS_ENDPOINT", "http://localhost:13141/v1"), api_key=os.getenv("LEADS_API_KEY", "testtoken"))
-    parsed_query = parse_search_query(response)
+    response = call_leads(prompt, endpoint=os.getenv("LEADS_ENDPOINT", "http://localhost:13141/v1"), api_key=os.getenv("LEADS_API_KEY", "testtoken"), n=num_samples, task="search")
+    if num_samples > 1:
+        parsed_query = merge_search_queries([parse_search_query(r) for r in response], min_votes)
+    else:
+        parsed_query = parse_search_query(response)
     sub_queries = split_medical_query(parsed_query)
     return sub_queries
 
-def batch_search_query_generation(pico_list, batch_size=20):
+def batch_search_query_generation(pico_list, batch_size=20, num_samples=1, min_votes=1):
     """
     Generate search queries for a list of PICO elements.
 
@@ -190,9 +227,14 @@ def batch_search_query_generation(pico_list, batch_size=20):
             - "intervention" (str): The intervention of the research
             - "comparison" (str): The comparison of the research
             - "outcome" (str): The outcome of the research
+        num_samples (int): If > 1, sample this many queries in one request per PICO and merge their terms.
+        min_votes (int): Min number of sampled queries a term must appear in when num_samples > 1.
     """
     all_prompts = [SEARCH_PROMPT_TEMPLATE.format(P=pico["population"], I=pico["intervention"], C=pico["comparison"], O=pico["outcome"]) for pico in pico_list]
-    all_results = call_leads(all_prompts, endpoint=os.getenv("LEADS_ENDPOINT", "http://localhost:13141/v1"), api_key=os.getenv("LEADS_API_KEY", "testtoken"), batch_size=batch_size)
-    parsed_results = [parse_search_query(result) for result in all_results]
+    all_results = call_leads(all_prompts, endpoint=os.getenv("LEADS_ENDPOINT", "http://localhost:13141/v1"), api_key=os.getenv("LEADS_API_KEY", "testtoken"), batch_size=batch_size, n=num_samples, task="search")
+    if num_samples > 1:
+        parsed_results = [merge_search_queries([parse_search_query(r) for r in result], min_votes) for result in all_results]
+    else:
+        parsed_results = [parse_search_query(result) for result in all_results]
     sub_queries = [split_medical_query(parsed_result) for parsed_result in parsed_results]
     return sub_queries
@@ -32,18 +32,9 @@ Format:
 
 import json
 import re
-import pdb
 import os
-import tiktoken
 from ..client import call_leads
-
-def cut_paper_content(paper_content, max_tokens=29_000):
-    encoding = tiktoken.get_encoding("cl100k_base")
-    tokens = encoding.encode(paper_content)
-    if len(tokens) > max_tokens:
-        tokens = tokens[:max_tokens]
-        paper_content = encoding.decode(tokens)
-    return paper_content
+from ..chunking import cut_paper_content, map_reduce_chunks, majority_vote, is_empty_value
 
 def stringfy_fields_info(fields_info):
     fields_info_str_list = []
@@ -94,44 +85,96 @@ def extract_json_from_llm_output(text, num_fields):
     
     return {"fields": fields} if fields else {"fields": [{"name": f"Field {i+1}", "value": "Not found"} for i in range(num_fields)]}
 
-def extract_study_characteristics(paper_content, fields_info):
+def merge_fields(chunk_results, num_fields):
+    """Merge the fields extracted from the chunks of a paper, taking the majority non-empty value of each field.
+
+    Ties go to the value of the earliest chunk.
+    """
+    values = {}
+    for result in chunk_results:
+        for field in result.get("fields", []):
+            if not isinstance(field, dict) or "name" not in field:
+                continue
+            values.setdefault(field["name"], []).append(field.get("value"))
+    fields = []
+    for name, field_values in values.items():
+        value = majority_vote(field_values)
+        fields.append({"name": name, "value": value if value is not None else "Not found"})
+    # drop the placeholders of chunks that could not be parsed if real fields were found
+    if any(not is_empty_value(f["value"]) for f in fields):
+        fields = [f for f in fields if not (f["name"].startswith("Field ") and is_empty_value(f["value"]))]
+    return {"fields": fields} if fields else {"fields": [{"name": f"Field {i+1}", "value": "Not found"} for i in range(num_fields)]}
+
+def extract_study_characteristics(paper_content, fields_info, max_content_tokens=29_000, map_reduce=False, chunk_tokens=8_000, chunk_overlap=500, max_tokens=None):
     """Extract study characteristics from a paper content.
 
     Args:
         paper_content (str): The content of the paper to be screened.
         fields_info (list[str]): The fields information to be extracted.
+        max_content_tokens (int): The paper is truncated to this many tokens.
+        map_reduce (bool): If True, extract from overlapping chunks of the whole paper concurrently and merge the results,
+            instead of truncating the paper.
+        chunk_tokens (int): The size of the chunks in map-reduce mode.
+        chunk_overlap (int): The overlap of consecutive chunks in map-reduce mode.
+        max_tokens (int): Max number of generated tokens, None to use the budget learned from earlier calls.
     """
+    if map_reduce:
+        return batch_extract_study_characteristics([paper_content], fields_info, map_reduce=True, chunk_tokens=chunk_tokens, chunk_overlap=chunk_overlap, max_tokens=max_tokens)[0]
     fields_info_str, num_fields = stringfy_fields_info(fields_info)
-    paper_content = cut_paper_content(paper_content)
+    paper_content = cut_paper_content(paper_content, max_content_tokens)
     prompt = STUDY_CHARACTERISTICS_EXTRACTION_PROMPT_TEMPLATE.format(paper_content=paper_content, num_fields=num_fields, fields_info=fields_info_str)
     results = call_leads(
         prompt, 
         endpoint=os.getenv("LEADS_ENDPOINT", "http://localhost:13141/v1"), 
         api_key=os.getenv("LEADS_API_KEY", "testtoken"), 
         temperature=0.1, 
-        max_tokens=1024
+        max_tokens=max_tokens,
+        task="study_characteristics"
         )
     # parse the results
     results = extract_json_from_llm_output(results, num_fields)
     return results
 
 
-def batch_extract_study_characteristics(paper_contents, fields_info):
+def batch_extract_study_characteristics(paper_contents, fields_info, max_content_tokens=29_000, map_reduce=False, chunk_tokens=8_000, chunk_overlap=500, max_tokens=None, batch_size=20):
     """Batch extract study characteristics from a list of paper contents.
 
     Args:
         paper_contents (list[str]): The contents of the papers to be screened.
         fields_info (list[str]): The fields information to be extracted.
+        max_content_tokens (int): The papers are truncated to this many tokens.
+        map_reduce (bool): If True, extract from overlapping chunks of the whole papers concurrently and merge the results,
+            instead of truncating the papers.
+        chunk_tokens (int): The size of the chunks in map-reduce mode.
+        chunk_overlap (int): The overlap of consecutive chunks in map-reduce mode.
+        max_tokens (int): Max number of generated tokens per paper or chunk, None to use the budget learned from earlier calls.
+        batch_size (int): Max number of concurrent requests in map-reduce mode.
     """
     fields_info_str, num_fields = stringfy_fields_info(fields_info)
-    paper_contents = [cut_paper_content(paper_content) for paper_content in paper_contents]
+    if map_reduce:
+        return map_reduce_chunks(
+            paper_contents,
+            lambda chunk: STUDY_CHARACTERISTICS_EXTRACTION_PROMPT_TEMPLATE.format(paper_content=chunk, num_fields=num_fields, fields_info=fields_info_str),
+            lambda chunk_results: merge_fields(chunk_results, num_fields),
+            parse_fn=lambda result: extract_json_from_llm_output(result, num_fields),
+            chunk_tokens=chunk_tokens,
+            overlap_tokens=chunk_overlap,
+            batch_size=batch_size,
+            endpoint=os.getenv("LEADS_ENDPOINT", "http://localhost:13141/v1"),
+            api_key=os.getenv("LEADS_API_KEY", "testtoken"),
+            temperature=0.1,
+            max_tokens=max_tokens,
+            task="study_characteristics"
+        )
+    paper_contents = [cut_paper_content(paper_content, max_content_tokens) for paper_content in paper_contents]
     prompts = [STUDY_CHARACTERISTICS_EXTRACTION_PROMPT_TEMPLATE.format(paper_content=paper_content, num_fields=num_fields, fields_info=fields_info_str) for paper_content in paper_contents]
     results = call_leads(
         prompts, 
         endpoint=os.getenv("LEADS_ENDPOINT", "http://localhost:13141/v1"), 
         api_key=os.getenv("LEADS_API_KEY", "testtoken"), 
         temperature=0.1, 
-        max_tokens=1024
+        max_tokens=max_tokens,
+        task="study_characteristics"
     )
     results = [extract_json_from_llm_output(result, num_fields) for result in results]
     return results
\ No newline at end of file
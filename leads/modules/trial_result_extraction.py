@@ -35,46 +35,88 @@ Format:
 
 import json
 import re
-import pdb
 import os
-import tiktoken
 from ..client import call_leads
+from ..chunking import truncate_paper_content, map_reduce_chunks, majority_vote
 
 
-def cut_paper_content(paper_content, max_tokens=29_000):
-    encoding = tiktoken.get_encoding("cl100k_base")
-    tokens = encoding.encode(paper_content)
-    if len(tokens) > max_tokens:
-        tokens = tokens[:max_tokens]
-        paper_content = encoding.decode(tokens)
-    return paper_content
-
 def parse_llm_output(llm_output):
     return json.loads(llm_output)
 
 
-def extract_trial_result(paper_content, outcome_def, group_def):
-    paper_content = cut_paper_content(paper_content)
+def merge_trial_results(chunk_outputs):
+    """Merge the results extracted from the chunks of a paper.
+
+    Chunks whose output is not valid JSON are skipped. The scalar fields take the majority
+    non-empty value, ties go to the earliest chunk. Result values are united by title,
+    keeping the value of the earliest chunk that reports it.
+    """
+    chunk_results = []
+    for output in chunk_outputs:
+        try:
+            result = parse_llm_output(output)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(result, dict):
+            chunk_results.append(result)
+    merged = {
+        key: majority_vote([result.get(key) for result in chunk_results])
+        for key in ["paramType", "unitOfMeasure", "timeFrame", "unitOfDenom", "denomValue"]
+    }
+    values = {}
+    for result in chunk_results:
+        for value in result.get("results") or []:
+            if not isinstance(value, dict) or value.get("value") is None:
+                continue
+            values.setdefault(str(value.get("title", "")).strip().lower(), value)
+    merged["results"] = list(values.values())
+    return merged
+
+
+def extract_trial_result(paper_content, outcome_def, group_def, max_content_tokens=29_000, smart_truncation=True, map_reduce=False, chunk_tokens=8_000, chunk_overlap=500, max_tokens=None):
+    if map_reduce:
+        # extract from overlapping chunks of the whole paper instead of truncating it
+        return batch_extract_trial_result([paper_content], outcome_def, group_def, map_reduce=True, chunk_tokens=chunk_tokens, chunk_overlap=chunk_overlap, max_tokens=max_tokens)[0]
+    # keep the sections relevant to the outcome and group, e.g. the results tables
+    query = f"{outcome_def} {group_def}" if smart_truncation else None
+    paper_content = truncate_paper_content(paper_content, query, max_content_tokens)
     prompt = RESULT_EXTRACTION_PROMPT_TEMPLATE.format(paper_content=paper_content, outcome_def=outcome_def, group_def=group_def)
     results = call_leads(prompt,
         endpoint=os.getenv("LEADS_ENDPOINT", "http://localhost:13141/v1"), 
         api_key=os.getenv("LEADS_API_KEY", "testtoken"), 
         temperature=0.1, 
-        max_tokens=1024
+        max_tokens=max_tokens,
+        task="trial_result"
         )
     results = parse_llm_output(results)
     return results
 
 
-def batch_extract_trial_result(paper_contents, outcome_def, group_def):
-    paper_contents = [cut_paper_content(paper_content) for paper_content in paper_contents]
+def batch_extract_trial_result(paper_contents, outcome_def, group_def, max_content_tokens=29_000, smart_truncation=True, map_reduce=False, chunk_tokens=8_000, chunk_overlap=500, max_tokens=None, batch_size=20):
+    if map_reduce:
+        return map_reduce_chunks(
+            paper_contents,
+            lambda chunk: RESULT_EXTRACTION_PROMPT_TEMPLATE.format(paper_content=chunk, outcome_def=outcome_def, group_def=group_def),
+            merge_trial_results,
+            chunk_tokens=chunk_tokens,
+            overlap_tokens=chunk_overlap,
+            batch_size=batch_size,
+            endpoint=os.getenv("LEADS_ENDPOINT", "http://localhost:13141/v1"),
+            api_key=os.getenv("LEADS_API_KEY", "testtoken"),
+            temperature=0.1,
+            max_tokens=max_tokens,
+            task="trial_result"
+        )
+    query = f"{outcome_def} {group_def}" if smart_truncation else None
+    paper_contents = [truncate_paper_content(paper_content, query, max_content_tokens) for paper_content in paper_contents]
     prompts = [RESULT_EXTRACTION_PROMPT_TEMPLATE.format(paper_content=paper_content, outcome_def=outcome_def, group_def=group_def) for paper_content in paper_contents]
     results = call_leads(
         prompts,
         endpoint=os.getenv("LEADS_ENDPOINT", "http://localhost:13141/v1"), 
         api_key=os.getenv("LEADS_API_KEY", "testtoken"), 
         temperature=0.1, 
-        max_tokens=1024
+        max_tokens=max_tokens,
+        task="trial_result"
         )
     results = [parse_llm_output(result) for result in results]
     return results
\ No newline at end of file
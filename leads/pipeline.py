@@ -0,0 +1,146 @@
+import asyncio
+
+from .modules.search import search_query_generation
+from .modules.screening import batch_screening_study
+from .pubmed import search_and_fetch_pubmed
+
+_DONE = object()
+
+
+async def _next_batch(queue, batch_size):
+    """Wait for the first item, then take whatever else is already queued, up to batch_size items.
+
+    Returns None once the stage upstream is done.
+    """
+    item = await queue.get()
+    if item is _DONE:
+        # leave the end marker for the other workers of this stage
+        queue.put_nowait(_DONE)
+        return None
+    batch = [item]
+    while len(batch) < batch_size:
+        try:
+            item = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            break
+        if item is _DONE:
+            queue.put_nowait(_DONE)
+            break
+        batch.append(item)
+    return batch
+
+
+async def _run_stage(worker, concurrency, out_queue):
+    """Run `concurrency` workers until the input is done, then mark the output as done."""
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        for worker_task in workers:
+            worker_task.cancel()
+    if out_queue is not None:
+        await out_queue.put(_DONE)
+
+
+async def async_review_pipeline(population=None, intervention=None, comparison=None, outcome=None,
+                                queries=None, fetch_fn=search_and_fetch_pubmed, extract_fn=None, extract_kwargs=None,
+                                include_fn=None, queue_size=256,
+                                fetch_concurrency=4, screen_concurrency=2, extract_concurrency=2,
+                                screen_batch_size=16, extract_batch_size=8):
+    """
+    Run search, fetch, screening and extraction as concurrent stages connected by bounded queues.
+
+    Screening starts on the first fetched records and extraction on the first included
+    records, instead of waiting for the previous stage to finish. The blocking `leads.api`
+    tasks run in worker threads. The bounded queues apply backpressure to the stages upstream.
+    A failed fetch or batch is recorded in "errors" and the other items go on.
+
+    Args:
+        population (str): The population of the research
+        intervention (str): The intervention of the research
+        comparison (str): The comparison of the research
+        outcome (str): The outcome of the research
+        queries (list[str]): Sub-queries to fetch, e.g. those of a previous run. Generated from the PICO if None.
+        fetch_fn (callable): Takes a sub-query and returns a list of record dicts with "id" and
+            "paper_content" keys, e.g. `leads.pubmed.search_and_fetch_pubmed` or `leads.ctgov.search_ctgov`.
+        extract_fn (callable): Optional `batch_extract_*` function run on the included records.
+        extract_kwargs (dict): Extra arguments of `extract_fn`, e.g. `fields_info`.
+        include_fn (callable): Takes (evaluations, score) and returns whether the record is included.
+            Defaults to a score of at least 0.5.
+        queue_size (int): Max number of items waiting between two stages.
+        fetch_concurrency (int): Number of concurrent fetch workers.
+        screen_concurrency (int): Number of concurrent screening batches.
+        extract_concurrency (int): Number of concurrent extraction batches.
+        screen_batch_size (int): Max number of records per screening batch.
+        extract_batch_size (int): Max number of records per extraction batch.
+    Returns:
+        dict: With "queries", "records" (id -> record), "screening" (id -> (evaluations, score)),
+            "extraction" (id -> result) and "errors" keys. Each error is a dict with the "stage",
+            the "query" (fetch) or "ids" (screening and extraction) and the "error" message.
+    """
+    pico = {"population": population, "intervention": intervention, "comparison": comparison, "outcome": outcome}
+    include_fn = include_fn or (lambda evaluations, score: score is not None and score >= 0.5)
+    extract_kwargs = extract_kwargs or {}
+    output = {"queries": [], "records": {}, "screening": {}, "extraction": {}, "errors": []}
+
+    query_queue = asyncio.Queue(maxsize=queue_size)
+    record_queue = asyncio.Queue(maxsize=queue_size)
+    include_queue = asyncio.Queue(maxsize=queue_size)
+
+    async def search_stage():
+        output["queries"] = queries if queries is not None else await asyncio.to_thread(search_query_generation, **pico)
+        for query in output["queries"]:
+            await query_queue.put(query)
+        await query_queue.put(_DONE)
+
+    async def fetch_worker():
+        while (batch := await _next_batch(query_queue, 1)) is not None:
+            try:
+                records = await asyncio.to_thread(fetch_fn, batch[0])
+            except Exception as e:
+                output["errors"].append({"stage": "fetch", "query": batch[0], "error": str(e)})
+                continue
+            for record in records:
+                # the same record is often hit by several sub-queries
+                if record["id"] in output["records"]:
+                    continue
+                output["records"][record["id"]] = record
+                await record_queue.put(record)
+
+    async def screen_worker():
+        while (batch := await _next_batch(record_queue, screen_batch_size)) is not None:
+            try:
+                results = await asyncio.to_thread(batch_screening_study, [r["paper_content"] for r in batch], **pico)
+            except Exception as e:
+                output["errors"].append({"stage": "screening", "ids": [r["id"] for r in batch], "error": str(e)})
+                continue
+            for record, result in zip(batch, results):
+                output["screening"][record["id"]] = result
+                if include_fn(*result):
+                    await include_queue.put(record)
+
+    async def extract_worker():
+        while (batch := await _next_batch(include_queue, extract_batch_size)) is not None:
+            if extract_fn is None:
+                continue
+            try:
+                results = await asyncio.to_thread(extract_fn, [r["paper_content"] for r in batch], **extract_kwargs)
+            except Exception as e:
+                output["errors"].append({"stage": "extraction", "ids": [r["id"] for r in batch], "error": str(e)})
+                continue
+            for record, result in zip(batch, results):
+                output["extraction"][record["id"]] = result
+
+    await asyncio.gather(
+        search_stage(),
+        _run_stage(fetch_worker, fetch_concurrency, record_queue),
+        _run_stage(screen_worker, screen_concurrency, include_queue),
+        _run_stage(extract_worker, extract_concurrency, None),
+    )
+    return output
+
+
+def review_pipeline(population=None, intervention=None, comparison=None, outcome=None, **kwargs):
+    """Synchronous wrapper of `async_review_pipeline`."""
+    assert population or intervention or comparison or outcome, "At least one of population, intervention, comparison, or outcome must be provided."
+    return asyncio.run(async_review_pipeline(population, intervention, comparison, outcome, **kwargs))
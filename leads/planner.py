@@ -0,0 +1,128 @@
+"""Dry-run planning of the token usage and duration of the `leads.api` tasks over a corpus.
+
+    plan = plan_batch(paper_contents, {"screening": pico}, token_budget=5_000_000)
+    results = batch_screening_study(paper_contents, **pico, **plan["tasks"]["screening"]["kwargs"])
+"""
+
+from .chunking import count_tokens
+from .usage import get_usage_stats
+from .modules.screening import SCREENING_PROMPT_TEMPLATE, get_eligibility_criteria, stringfy_criteria
+from .modules.study_characteristics_extraction import STUDY_CHARACTERISTICS_EXTRACTION_PROMPT_TEMPLATE, stringfy_fields_info
+from .modules.population_statistics_extraction import PARTICIPANT_EXTRACTION_PROMPT_TEMPLATE
+from .modules.arm_design_extraction import ARM_DESIGN_EXTRACTION_PROMPT_TEMPLATE
+from .modules.trial_result_extraction import RESULT_EXTRACTION_PROMPT_TEMPLATE
+
+
+def _screening_prompt(paper_content, population=None, intervention=None, comparison=None, outcome=None):
+    criteria, num_criteria = get_eligibility_criteria({"P": population or "", "I": intervention or "", "C": comparison or "", "O": outcome or ""})
+    return SCREENING_PROMPT_TEMPLATE.format(paper_content=paper_content, num_criteria=num_criteria, criteria_text=stringfy_criteria(criteria))
+
+
+def _study_characteristics_prompt(paper_content, fields_info):
+    fields_info_str, num_fields = stringfy_fields_info(fields_info)
+    return STUDY_CHARACTERISTICS_EXTRACTION_PROMPT_TEMPLATE.format(paper_content=paper_content, num_fields=num_fields, fields_info=fields_info_str)
+
+
+def _population_statistics_prompt(paper_content, measureDef, paramType, unitOfMeasure, groupDef):
+    return PARTICIPANT_EXTRACTION_PROMPT_TEMPLATE.format(paper_content=paper_content, measureDef=measureDef, paramType=paramType, unitOfMeasure=unitOfMeasure, groupDef=groupDef)
+
+
+def _arm_design_prompt(paper_content):
+    return ARM_DESIGN_EXTRACTION_PROMPT_TEMPLATE.format(paper_content=paper_content)
+
+
+def _trial_result_prompt(paper_content, outcome_def, group_def):
+    return RESULT_EXTRACTION_PROMPT_TEMPLATE.format(paper_content=paper_content, outcome_def=outcome_def, group_def=group_def)
+
+
+# task name (as recorded by `call_leads`) -> prompt of a paper given the arguments of the task
+TASK_PROMPTS = {
+    "screening": _screening_prompt,
+    "study_characteristics": _study_characteristics_prompt,
+    "population_statistics": _population_statistics_prompt,
+    "arm_design": _arm_design_prompt,
+    "trial_result": _trial_result_prompt,
+}
+
+
+def plan_batch(paper_contents, tasks, token_budget=None, max_content_tokens=29_000, min_content_tokens=1_000,
+               default_max_tokens=1024, quantile=0.99, margin=1.1, min_samples=20, stats=None, throughput=None):
+    """
+    Estimate the tokens and the duration of running tasks over a corpus, without calling the model.
+
+    The completion lengths are estimated from the usage recorded by `call_leads` (see `leads.usage`),
+    and `max_tokens` of each task is its `UsageStats.output_budget`. With a token budget, the papers
+    are truncated to the largest limit for which the prompt tokens plus `max_tokens` per prompt fit
+    into the budget, so the budget holds in the worst case.
+    The plan assumes one prompt per paper and task, i.e. no map-reduce, sampling or per-criterion screening.
+
+    Args:
+        paper_contents (list[str]): The contents of the papers.
+        tasks (dict): Task name (a key of `TASK_PROMPTS`) -> arguments of the task, e.g.
+            {"screening": {"population": ..., "intervention": ...}, "trial_result": {"outcome_def": ..., "group_def": ...}}.
+        token_budget (int): Max number of prompt + completion tokens over all the tasks.
+        max_content_tokens (int): The papers are truncated to at most this many tokens.
+        min_content_tokens (int): The papers are not truncated to fewer tokens to meet the budget.
+        default_max_tokens (int): `max_tokens` of the tasks with fewer than `min_samples` recorded completions.
+        quantile (float): Quantile of the recorded completion lengths used for `max_tokens`.
+        margin (float): Factor applied to the quantile.
+        min_samples (int): Min number of recorded completions of a task to estimate its `max_tokens`.
+        stats (UsageStats): The recorded usage, defaults to `leads.usage.get_usage_stats()`.
+        throughput (float): Tokens per second of the model server, defaults to the measured one.
+    Returns:
+        dict: With "tasks" (task -> {"num_prompts", "prompt_tokens", "completion_tokens", "max_tokens", "kwargs"},
+            where "kwargs" are the arguments to pass to the `batch_*` function), "max_content_tokens",
+            "prompt_tokens", "completion_tokens", "max_total_tokens" and "estimated_seconds" keys.
+    Raises:
+        ValueError: If the budget cannot be met even with papers truncated to `min_content_tokens`.
+    """
+    stats = stats if stats is not None else get_usage_stats()
+    content_tokens = [count_tokens(paper_content) for paper_content in paper_contents]
+    # tokens of each prompt without the paper, and the output budget of each task
+    overheads, max_tokens, completion_tokens = {}, {}, {}
+    for task, task_kwargs in tasks.items():
+        overheads[task] = count_tokens(TASK_PROMPTS[task]("", **task_kwargs))
+        max_tokens[task] = stats.output_budget(task, quantile, margin, min_samples, default_max_tokens)
+        mean_length = stats.mean_completion_tokens(task)
+        completion_tokens[task] = mean_length if mean_length is not None else max_tokens[task]
+
+    def prompt_tokens(limit):
+        return sum(min(num_tokens, limit) for num_tokens in content_tokens)
+
+    def max_total_tokens(limit):
+        return sum(prompt_tokens(limit) + len(content_tokens) * (overheads[task] + max_tokens[task]) for task in tasks)
+
+    limit = max_content_tokens
+    if token_budget is not None and max_total_tokens(limit) > token_budget:
+        if max_total_tokens(min_content_tokens) > token_budget:
+            raise ValueError(
+                f"The token budget of {token_budget} cannot be met, {max_total_tokens(min_content_tokens)} tokens are needed "
+                f"with papers truncated to {min_content_tokens} tokens."
+            )
+        # the largest limit that fits into the budget
+        low, high = min_content_tokens, max_content_tokens
+        while low < high:
+            mid = (low + high + 1) // 2
+            if max_total_tokens(mid) <= token_budget:
+                low = mid
+            else:
+                high = mid - 1
+        limit = low
+
+    plan = {"tasks": {}, "max_content_tokens": limit, "prompt_tokens": 0, "completion_tokens": 0, "max_total_tokens": max_total_tokens(limit)}
+    for task in tasks:
+        task_prompt_tokens = prompt_tokens(limit) + len(content_tokens) * overheads[task]
+        task_completion_tokens = round(len(content_tokens) * completion_tokens[task])
+        plan["tasks"][task] = {
+            "num_prompts": len(content_tokens),
+            "prompt_tokens": task_prompt_tokens,
+            "completion_tokens": task_completion_tokens,
+            "max_tokens": max_tokens[task],
+            "kwargs": {"max_content_tokens": limit, "max_tokens": max_tokens[task]},
+        }
+        plan["prompt_tokens"] += task_prompt_tokens
+        plan["completion_tokens"] += task_completion_tokens
+
+    throughput = throughput if throughput is not None else stats.throughput()
+    plan["estimated_seconds"] = (plan["prompt_tokens"] + plan["completion_tokens"]) / throughput if throughput else None
+    return plan
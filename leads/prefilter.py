@@ -0,0 +1,257 @@
+import os
+import json
+import hashlib
+from functools import lru_cache
+import numpy as np
+
+from .modules.screening import batch_screening_study
+
+DEFAULT_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+@lru_cache(maxsize=2)
+def _load_embedding_model(model_name):
+    from transformers import AutoTokenizer, AutoModel
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name)
+    model.eval()
+    return tokenizer, model
+
+
+def embed_texts(texts, model_name=DEFAULT_EMBEDDING_MODEL, batch_size=32, max_length=256):
+    """
+    Embed texts on CPU with a small sentence embedding model.
+
+    Args:
+        texts (list[str]): The texts to embed. Only the first `max_length` tokens are used,
+            which covers the title and most of the abstract.
+        model_name (str): The Hugging Face model to use, mean pooled.
+        batch_size (int): Number of texts embedded at once.
+        max_length (int): Max number of tokens per text.
+    Returns:
+        np.ndarray: float32 matrix of L2-normalized embeddings, one row per text.
+    """
+    import torch
+    tokenizer, model = _load_embedding_model(model_name)
+    embeddings = []
+    with torch.no_grad():
+        for i in range(0, len(texts), batch_size):
+            inputs = tokenizer(texts[i:i + batch_size], padding=True, truncation=True,
+                               max_length=max_length, return_tensors="pt")
+            hidden = model(**inputs).last_hidden_state
+            mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            pooled = torch.nn.functional.normalize(pooled, p=2, dim=1)
+            embeddings.append(pooled.numpy().astype(np.float32))
+    if not embeddings:
+        return np.zeros((0, model.config.hidden_size), dtype=np.float32)
+    return np.concatenate(embeddings, axis=0)
+
+
+class EmbeddingIndex:
+    """
+    A persistent index of record embeddings, keyed by the hash of the record text.
+
+    Records that were already embedded, in this or an earlier review, are not embedded again.
+    The index is stored in the `path` directory as `meta.json`, `keys.txt` (one key per line)
+    and `vectors.f32` (the raw float32 rows). Saving only appends the new records, and the
+    saved vectors are memory-mapped instead of loaded.
+    """
+
+    def __init__(self, path=None, model_name=DEFAULT_EMBEDDING_MODEL):
+        self.path = path
+        self.model_name = model_name
+        self._keys = {}
+        self._saved = np.zeros((0, 0), dtype=np.float32)
+        self._new = []
+        if path and os.path.exists(os.path.join(path, "meta.json")):
+            with open(os.path.join(path, "meta.json"), "r") as f:
+                meta = json.load(f)
+            if meta["model_name"] != model_name:
+                raise ValueError(f"Index at {path} was built with {meta['model_name']}, not {model_name}")
+            with open(os.path.join(path, "keys.txt"), "r") as f:
+                # the last line has no newline if a save was interrupted while writing it
+                keys = f.read().split("\n")[:-1]
+            vectors_path = os.path.join(path, "vectors.f32")
+            # ignore the rows of an interrupted save that were written without their keys, or cut
+            num_rows = min(len(keys), os.path.getsize(vectors_path) // (meta["dim"] * 4))
+            if num_rows:
+                self._saved = np.memmap(vectors_path, dtype=np.float32, mode="r", shape=(num_rows, meta["dim"]))
+                self._keys = {k: i for i, k in enumerate(keys[:num_rows])}
+
+    def __len__(self):
+        return len(self._keys)
+
+    @staticmethod
+    def text_key(text):
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def _vector(self, i):
+        return self._saved[i] if i < len(self._saved) else self._new[i - len(self._saved)]
+
+    def embed(self, texts):
+        """Return the embeddings of texts, computing only the ones missing from the index."""
+        keys = [self.text_key(t) for t in texts]
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in self._keys and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = embed_texts(list(missing.values()), self.model_name)
+            for key, vector in zip(missing.keys(), vectors):
+                self._keys[key] = len(self._saved) + len(self._new)
+                self._new.append(vector)
+        return np.stack([self._vector(self._keys[k]) for k in keys]) if keys else np.zeros((0, 0), dtype=np.float32)
+
+    def save(self):
+        """Append the records embedded since the last save to the index files."""
+        if not self.path or not self._new:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        dim = int(self._new[0].shape[0])
+        sorted_keys = sorted(self._keys, key=self._keys.get)
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump({"model_name": self.model_name, "dim": dim}, f)
+        # vectors first, so an interrupted save leaves rows without keys, which are ignored on load.
+        # Both files are cut back to the loaded records first, so the leftovers of an interrupted
+        # save are overwritten instead of shifting the new rows away from their keys.
+        with open(os.path.join(self.path, "vectors.f32"), "ab") as f:
+            f.truncate(len(self._saved) * dim * 4)
+            f.write(np.stack(self._new).astype(np.float32).tobytes())
+        with open(os.path.join(self.path, "keys.txt"), "a") as f:
+            f.truncate(sum(len(key) + 1 for key in sorted_keys[:len(self._saved)]))
+            f.write("".join(f"{key}\n" for key in sorted_keys[len(self._saved):]))
+        self._saved = np.memmap(os.path.join(self.path, "vectors.f32"), dtype=np.float32, mode="r", shape=(len(self._keys), dim))
+        self._new = []
+
+
+def stringfy_pico(population=None, intervention=None, comparison=None, outcome=None):
+    parts = [("Population", population), ("Intervention", intervention), ("Comparison", comparison), ("Outcome", outcome)]
+    return ". ".join(f"{name}: {value}" for name, value in parts if value)
+
+
+def recall_threshold(similarities, gold, min_recall=0.95):
+    """
+    Return the highest similarity cutoff that keeps at least `min_recall` of the relevant records.
+
+    Args:
+        similarities (np.ndarray): The PICO similarity of each record.
+        gold (list): Relevance labels (bool or None per record).
+        min_recall (float): Min recall of the relevant records.
+    Returns:
+        float: The cutoff, or None if no record is relevant.
+    """
+    relevant = np.array([bool(g) for g in gold])
+    if not relevant.any():
+        return None
+    relevant_similarities = np.sort(np.asarray(similarities)[relevant])[::-1]
+    num_needed = int(np.ceil(min_recall * len(relevant_similarities)))
+    return float(relevant_similarities[num_needed - 1])
+
+
+def tune_prefilter_threshold(paper_contents, gold, population=None, intervention=None, comparison=None, outcome=None,
+                             index=None, min_recall=0.95):
+    """
+    Tune the similarity threshold of `prefilter_records` on a labeled sample of records.
+
+    The returned threshold can be passed as `threshold` to pre-filter the unlabeled records of the review.
+
+    Args:
+        paper_contents (list): The paper contents of the labeled sample.
+        gold (list): Relevance labels (bool or None per record) of the sample.
+        population (str): The population of the research
+        intervention (str): The intervention of the research
+        comparison (str): The comparison of the research
+        outcome (str): The outcome of the research
+        index (EmbeddingIndex): Index to reuse embeddings from, a temporary one is used if None.
+        min_recall (float): Min recall of the relevant records of the sample.
+    Returns:
+        float: The threshold, or None if no record of the sample is relevant.
+    """
+    assert population or intervention or comparison or outcome, "At least one of population, intervention, comparison, or outcome must be provided."
+    index = index if index is not None else EmbeddingIndex()
+    record_vectors = index.embed(list(paper_contents))
+    query_vector = embed_texts([stringfy_pico(population, intervention, comparison, outcome)], index.model_name)[0]
+    index.save()
+    return recall_threshold(record_vectors @ query_vector, gold, min_recall)
+
+
+def prefilter_records(paper_contents, population=None, intervention=None, comparison=None, outcome=None,
+                      top_k=None, threshold=None, index=None, gold=None, min_recall=0.95):
+    """
+    Select the records that are similar enough to the PICO criteria to be worth LLM screening.
+
+    A record is kept if it is among the `top_k` most similar records or its cosine similarity
+    is at least `threshold`. If `gold` labels are given, the cutoff is lowered until at least
+    `min_recall` of the relevant records are kept (recall guard). To tune the threshold on a
+    labeled sample and reuse it on unlabeled records, see `tune_prefilter_threshold`.
+
+    Args:
+        paper_contents (list): A list of paper contents (title and abstract).
+        population (str): The population of the research
+        intervention (str): The intervention of the research
+        comparison (str): The comparison of the research
+        outcome (str): The outcome of the research
+        top_k (int): Number of most similar records to keep.
+        threshold (float): Min cosine similarity of the records to keep.
+        index (EmbeddingIndex): Index to reuse embeddings from, a temporary one is used if None.
+        gold (list): Optional relevance labels (bool or None per record) used for the recall guard.
+        min_recall (float): Min recall of the relevant records in `gold`.
+    Returns:
+        tuple: (keep, report), the sorted indices of the kept records and a dict describing the cut.
+    """
+    assert population or intervention or comparison or outcome, "At least one of population, intervention, comparison, or outcome must be provided."
+    assert top_k is not None or threshold is not None, "At least one of top_k or threshold must be provided."
+    index = index if index is not None else EmbeddingIndex()
+    record_vectors = index.embed(list(paper_contents))
+    query_vector = embed_texts([stringfy_pico(population, intervention, comparison, outcome)], index.model_name)[0]
+    similarities = record_vectors @ query_vector if len(paper_contents) else np.zeros(0, dtype=np.float32)
+
+    keep = np.zeros(len(similarities), dtype=bool)
+    if threshold is not None:
+        keep |= similarities >= threshold
+    if top_k is not None and top_k > 0:
+        keep[np.argsort(-similarities, kind="stable")[:top_k]] = True
+
+    report = {
+        "num_records": int(len(similarities)),
+        "threshold": threshold,
+        "top_k": top_k,
+        "recall": None,
+    }
+    if gold is not None:
+        relevant = np.array([bool(g) for g in gold])
+        if relevant.any():
+            recall = keep[relevant].mean()
+            if recall < min_recall:
+                # lower the cutoff to the similarity of the last relevant record needed for min_recall
+                cutoff = recall_threshold(similarities, gold, min_recall)
+                keep |= similarities >= cutoff
+                report["threshold"] = cutoff
+                recall = keep[relevant].mean()
+            report["recall"] = float(recall)
+    report["num_kept"] = int(keep.sum())
+    report["min_similarity_kept"] = float(similarities[keep].min()) if keep.any() else None
+    index.save()
+    return np.flatnonzero(keep), report
+
+
+def prefiltered_batch_screening_study(paper_contents, population=None, intervention=None, comparison=None, outcome=None,
+                                      top_k=None, threshold=None, index=None, gold=None, min_recall=0.95):
+    """
+    Perform screening study on a list of paper contents, only sending the records kept by
+    `prefilter_records` to the LLM.
+
+    Returns:
+        tuple: (results, report). Results are the same as `batch_screening_study`, with
+            ([], None) for the records skipped by the pre-filter.
+    """
+    keep, report = prefilter_records(paper_contents, population, intervention, comparison, outcome,
+                                     top_k=top_k, threshold=threshold, index=index, gold=gold, min_recall=min_recall)
+    results = [([], None) for _ in paper_contents]
+    if len(keep) > 0:
+        screened = batch_screening_study([paper_contents[i] for i in keep], population=population, intervention=intervention,
+                                         comparison=comparison, outcome=outcome)
+        for i, result in zip(keep, screened):
+            results[i] = result
+    return results, report
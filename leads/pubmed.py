@@ -0,0 +1,82 @@
+import os
+import datetime
+import xml.etree.ElementTree as ET
+import requests
+
+EUTILS_BASE_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
+# esearch only returns the first 10,000 hits of a query, paging past them is an error
+ESEARCH_MAX_RESULTS = 10_000
+
+
+def _eutils_params(params):
+    api_key = os.getenv("NCBI_API_KEY")
+    if api_key:
+        params["api_key"] = api_key
+    return params
+
+
+def search_pubmed(query, retmax=100, mindate=None, datetype="edat"):
+    """
+    Search PubMed and return the PMIDs of the hits.
+
+    Args:
+        query (str): The PubMed query, e.g. one of the sub-queries of `search_query_generation`.
+        retmax (int): Max number of PMIDs to return, None for all the hits. At most
+            `ESEARCH_MAX_RESULTS` PMIDs are returned either way.
+        mindate (str): Only return articles with a `datetype` date on or after this date (YYYY-MM-DD).
+        datetype (str): The date to filter on, "edat" (added to PubMed) or "mdat" (last modified).
+    Returns:
+        list[str]: The PMIDs.
+    """
+    params = {"db": "pubmed", "term": query, "retmode": "json"}
+    if mindate:
+        # E-utilities needs both ends of the date range
+        params.update({
+            "mindate": mindate.replace("-", "/"),
+            "maxdate": datetime.date.today().strftime("%Y/%m/%d"),
+            "datetype": datetype,
+        })
+    params["retmax"] = ESEARCH_MAX_RESULTS if retmax is None else min(retmax, ESEARCH_MAX_RESULTS)
+    response = requests.get(f"{EUTILS_BASE_URL}/esearch.fcgi", params=_eutils_params(params), timeout=30)
+    response.raise_for_status()
+    return response.json()["esearchresult"]["idlist"]
+
+
+def fetch_pubmed_abstracts(pmids, batch_size=200):
+    """
+    Fetch the titles and abstracts of PubMed articles.
+
+    Args:
+        pmids (list[str]): The PMIDs to fetch.
+        batch_size (int): Number of PMIDs per request.
+    Returns:
+        list[dict]: One record per article with "id", "title", "abstract" and "paper_content" keys.
+    """
+    records = []
+    for i in range(0, len(pmids), batch_size):
+        response = requests.post(
+            f"{EUTILS_BASE_URL}/efetch.fcgi",
+            data=_eutils_params({"db": "pubmed", "id": ",".join(pmids[i:i + batch_size]), "retmode": "xml"}),
+            timeout=60,
+        )
+        response.raise_for_status()
+        root = ET.fromstring(response.content)
+        for article in root.iter("PubmedArticle"):
+            pmid = article.findtext(".//MedlineCitation/PMID")
+            title = "".join(article.find(".//ArticleTitle").itertext()) if article.find(".//ArticleTitle") is not None else ""
+            abstract = "\n".join(
+                (f"{part.get('Label')}: " if part.get("Label") else "") + "".join(part.itertext())
+                for part in article.findall(".//Abstract/AbstractText")
+            )
+            records.append({
+                "id": pmid,
+                "title": title,
+                "abstract": abstract,
+                "paper_content": f"[Title] {title}\n[Abstract] {abstract}",
+            })
+    return records
+
+
+def search_and_fetch_pubmed(query, retmax=100, mindate=None, datetype="edat"):
+    """Search PubMed and fetch the titles and abstracts of the hits."""
+    return fetch_pubmed_abstracts(search_pubmed(query, retmax=retmax, mindate=mindate, datetype=datetype))
@@ -0,0 +1,245 @@
+import json
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .modules.screening import batch_screening_study
+
+SCREENING_RESULT_SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("evaluations", pa.list_(pa.struct([
+        ("eligibility", pa.string()),
+        ("rationale", pa.string()),
+    ]))),
+    ("score", pa.float64()),
+])
+
+EXTRACTION_RESULT_SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("result", pa.string()),
+])
+
+STUDY_CHARACTERISTICS_RESULT_SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("fields", pa.list_(pa.struct([
+        ("name", pa.string()),
+        ("value", pa.string()),
+    ]))),
+])
+
+# extraction function name -> schema of its results, the other tasks use EXTRACTION_RESULT_SCHEMA
+EXTRACTION_RESULT_SCHEMAS = {
+    "batch_extract_study_characteristics": STUDY_CHARACTERISTICS_RESULT_SCHEMA,
+}
+
+
+def _file_format(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".parquet":
+        return "parquet"
+    if ext in (".arrow", ".feather", ".ipc"):
+        return "arrow"
+    if ext in (".jsonl", ".ndjson"):
+        return "jsonl"
+    raise ValueError(f"Unsupported record file format: {path}")
+
+
+def _iter_arrow_batches(path, columns, batch_size):
+    fmt = _file_format(path)
+    if fmt == "parquet":
+        parquet_file = pq.ParquetFile(path, memory_map=True)
+        yield from parquet_file.iter_batches(batch_size=batch_size, columns=columns)
+        return
+    source = pa.memory_map(path, "r")
+    try:
+        reader = pa.ipc.open_file(source)
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    except pa.ArrowInvalid:
+        source.seek(0)
+        batches = pa.ipc.open_stream(source)
+    for batch in batches:
+        batch = batch.select(columns)
+        # re-slice large batches so memory use only depends on batch_size
+        for offset in range(0, batch.num_rows, batch_size):
+            yield batch.slice(offset, batch_size)
+
+
+def iter_records(path, id_column="id", content_column="paper_content", batch_size=256):
+    """
+    Stream records from a Parquet, Arrow IPC or JSONL file in batches.
+
+    Parquet and Arrow files are memory-mapped, so only the current batch is
+    materialized as Python strings.
+
+    Args:
+        path (str): Path to a .parquet, .arrow/.feather/.ipc or .jsonl file.
+        id_column (str): The column holding the record ID (e.g. the PMID).
+        content_column (str): The column holding the paper content.
+        batch_size (int): Number of records per yielded batch.
+    Yields:
+        tuple: (ids, paper_contents), two lists of length <= batch_size.
+    """
+    if _file_format(path) == "jsonl":
+        ids, contents = [], []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                ids.append(str(record[id_column]))
+                contents.append(record.get(content_column) or "")
+                if len(ids) >= batch_size:
+                    yield ids, contents
+                    ids, contents = [], []
+        if ids:
+            yield ids, contents
+        return
+
+    for batch in _iter_arrow_batches(path, [id_column, content_column], batch_size):
+        ids = [str(i) for i in batch.column(0).to_pylist()]
+        contents = [c or "" for c in batch.column(1).to_pylist()]
+        yield ids, contents
+
+
+def screening_results_to_batch(ids, results):
+    """Convert the output of `batch_screening_study` into an Arrow record batch keyed by record ID."""
+    evaluations = [
+        [{"eligibility": e.get("eligibility"), "rationale": e.get("rationale")} for e in evals]
+        for evals, _ in results
+    ]
+    scores = [score for _, score in results]
+    return pa.RecordBatch.from_arrays(
+        [
+            pa.array(ids, type=pa.string()),
+            pa.array(evaluations, type=SCREENING_RESULT_SCHEMA.field("evaluations").type),
+            pa.array(scores, type=pa.float64()),
+        ],
+        schema=SCREENING_RESULT_SCHEMA,
+    )
+
+
+def _field_value(value):
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+
+def extraction_results_to_batch(ids, results, schema=EXTRACTION_RESULT_SCHEMA):
+    """Convert the output of a `batch_extract_*` function into an Arrow record batch keyed by record ID.
+
+    With `STUDY_CHARACTERISTICS_RESULT_SCHEMA`, the fields are stored as a typed list of
+    (name, value) structs, where non-string values are JSON-encoded. Otherwise each result is
+    stored as a JSON string, since the population statistics, arm design and trial result
+    outputs have no fixed structure.
+    """
+    if schema == STUDY_CHARACTERISTICS_RESULT_SCHEMA:
+        fields = [
+            [{"name": f.get("name"), "value": _field_value(f.get("value"))} for f in r.get("fields", []) if isinstance(f, dict)]
+            for r in results
+        ]
+        column = pa.array(fields, type=schema.field("fields").type)
+    else:
+        column = pa.array([json.dumps(r) for r in results], type=pa.string())
+    return pa.RecordBatch.from_arrays([pa.array(ids, type=pa.string()), column], schema=schema)
+
+
+class ResultWriter:
+    """Write result record batches incrementally to an Arrow IPC or Parquet file."""
+
+    def __init__(self, path, schema):
+        self.path = path
+        self.schema = schema
+        fmt = _file_format(path)
+        if fmt == "parquet":
+            self._writer = pq.ParquetWriter(path, schema)
+        elif fmt == "arrow":
+            self._sink = pa.OSFile(path, "wb")
+            self._writer = pa.ipc.new_file(self._sink, schema)
+        else:
+            raise ValueError(f"Results can only be written as .parquet or .arrow, got: {path}")
+
+    def write(self, batch):
+        self._writer.write_batch(batch)
+
+    def close(self):
+        self._writer.close()
+        if hasattr(self, "_sink"):
+            self._sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_results(path):
+    """
+    Open a results file written by `stream_screening_study` or `stream_extraction`.
+
+    Arrow IPC files are memory-mapped, so the returned table references the
+    file buffers directly (zero-copy) and can be joined with the input by "id".
+
+    Args:
+        path (str): Path to a .arrow or .parquet results file.
+    Returns:
+        pyarrow.Table: The results table.
+    """
+    if _file_format(path) == "parquet":
+        return pq.read_table(path, memory_map=True)
+    return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+
+
+def stream_screening_study(input_path, output_path, population=None, intervention=None, comparison=None, outcome=None,
+                           id_column="id", content_column="paper_content", batch_size=256):
+    """
+    Screen every record of a large file without loading the whole corpus into memory.
+
+    Args:
+        input_path (str): Path to a .parquet, .arrow or .jsonl file with the records.
+        output_path (str): Path of the .arrow or .parquet file to write the results to.
+        population (str): The population of the research
+        intervention (str): The intervention of the research
+        comparison (str): The comparison of the research
+        outcome (str): The outcome of the research
+        id_column (str): The column holding the record ID.
+        content_column (str): The column holding the paper content.
+        batch_size (int): Number of records screened per batch.
+    Returns:
+        int: The number of screened records.
+    """
+    num_records = 0
+    with ResultWriter(output_path, SCREENING_RESULT_SCHEMA) as writer:
+        for ids, contents in iter_records(input_path, id_column, content_column, batch_size):
+            results = batch_screening_study(contents, population=population, intervention=intervention,
+                                            comparison=comparison, outcome=outcome)
+            writer.write(screening_results_to_batch(ids, results))
+            num_records += len(ids)
+    return num_records
+
+
+def stream_extraction(batch_extract_fn, input_path, output_path, id_column="id", content_column="paper_content",
+                      batch_size=256, **kwargs):
+    """
+    Run a `batch_extract_*` function over every record of a large file in batches.
+
+    Args:
+        batch_extract_fn (callable): One of the `batch_extract_*` functions from `leads.api`. The results
+            are written with its schema from `EXTRACTION_RESULT_SCHEMAS`, or as JSON strings.
+        input_path (str): Path to a .parquet, .arrow or .jsonl file with the records.
+        output_path (str): Path of the .arrow or .parquet file to write the results to.
+        id_column (str): The column holding the record ID.
+        content_column (str): The column holding the paper content.
+        batch_size (int): Number of records processed per batch.
+        **kwargs: Extra arguments passed to `batch_extract_fn`, e.g. `fields_info`.
+    Returns:
+        int: The number of processed records.
+    """
+    num_records = 0
+    schema = EXTRACTION_RESULT_SCHEMAS.get(batch_extract_fn.__name__, EXTRACTION_RESULT_SCHEMA)
+    with ResultWriter(output_path, schema) as writer:
+        for ids, contents in iter_records(input_path, id_column, content_column, batch_size):
+            results = batch_extract_fn(contents, **kwargs)
+            writer.write(extraction_results_to_batch(ids, results, schema))
+            num_records += len(ids)
+    return num_records
@@ -0,0 +1,176 @@
+import numpy as np
+
+# int8 codes of the eligibility decisions in a label matrix
+ELIGIBILITY_CODES = {
+    "UNCERTAIN": 0,
+    "YES": 1,
+    "PARTIAL": 2,
+    "NO": 3,
+}
+MISSING_CODE = -1
+
+CRITERIA_NAMES = ["Population", "Intervention", "Comparison", "Outcome"]
+
+# same weights as `get_score` in modules/screening.py
+DEFAULT_LABEL_WEIGHTS = {
+    "YES": 1.0,
+    "PARTIAL": 0.5,
+    "UNCERTAIN": 0.0,
+    "NO": -1.0,
+}
+
+
+def to_label_matrix(evaluations_list, num_criteria=4):
+    """
+    Convert per-paper evaluations into a records x criteria int8 label matrix.
+
+    Args:
+        evaluations_list (list): A list of evaluations (one list of {"eligibility": ...} dicts per paper),
+            or the list of (evaluations, score) tuples returned by `batch_screening_study`.
+        num_criteria (int): Number of criteria (columns). Papers with more evaluations widen the
+            matrix, so that no decision is dropped.
+    Returns:
+        np.ndarray: int8 matrix coded by ELIGIBILITY_CODES, MISSING_CODE where no decision was made.
+            Labels are matched exactly like in `get_score`, and the others (e.g. "N/A" or "yes")
+            are coded as UNCERTAIN, which `get_score` also counts as 0.
+    """
+    evaluations_list = [evaluations[0] if isinstance(evaluations, tuple) else evaluations for evaluations in evaluations_list]
+    num_criteria = max([num_criteria] + [len(evaluations) for evaluations in evaluations_list])
+    labels = np.full((len(evaluations_list), num_criteria), MISSING_CODE, dtype=np.int8)
+    for i, evaluations in enumerate(evaluations_list):
+        for j, evaluation in enumerate(evaluations):
+            labels[i, j] = ELIGIBILITY_CODES.get(evaluation.get("eligibility"), ELIGIBILITY_CODES["UNCERTAIN"])
+    return labels
+
+
+def _criterion_index(criterion):
+    if isinstance(criterion, str):
+        return CRITERIA_NAMES.index(criterion)
+    return criterion
+
+
+def score_label_matrix(labels, label_weights=None, criterion_weights=None):
+    """
+    Compute the overall score of every record from the label matrix.
+
+    The score is normalized by the (weighted) number of decisions of the record, so with the
+    default weights it is the same as `get_score` of the evaluations the matrix was built from.
+
+    Args:
+        labels (np.ndarray): The label matrix from `to_label_matrix`.
+        label_weights (dict): Score of each eligibility label, defaults to DEFAULT_LABEL_WEIGHTS.
+        criterion_weights (list or dict): Weight of each criterion, by index or criterion name. Defaults to equal weights.
+    Returns:
+        np.ndarray: float64 scores, 0 for records without any decision.
+    """
+    label_weights = {**DEFAULT_LABEL_WEIGHTS, **(label_weights or {})}
+    # lookup table indexed by code + 1, so MISSING_CODE maps to slot 0
+    value_table = np.zeros(len(ELIGIBILITY_CODES) + 1, dtype=np.float64)
+    for label, code in ELIGIBILITY_CODES.items():
+        value_table[code + 1] = label_weights[label]
+
+    weights = np.ones(labels.shape[1], dtype=np.float64)
+    if isinstance(criterion_weights, dict):
+        for criterion, weight in criterion_weights.items():
+            weights[_criterion_index(criterion)] = weight
+    elif criterion_weights is not None:
+        weights = np.asarray(criterion_weights, dtype=np.float64)
+
+    present = (labels != MISSING_CODE) * weights
+    total = (value_table[labels.astype(np.int64) + 1] * present).sum(axis=1)
+    norm = present.sum(axis=1)
+    return np.divide(total, norm, out=np.zeros_like(total), where=norm > 0)
+
+
+def exclusion_mask(labels, rules):
+    """
+    Apply per-criterion exclusion rules, e.g. {"Population": ["NO"]} for "any NO on Population excludes".
+
+    Args:
+        labels (np.ndarray): The label matrix from `to_label_matrix`.
+        rules (dict): Maps a criterion (name or column index) to the labels that exclude a record.
+    Returns:
+        np.ndarray: Boolean mask, True for excluded records.
+    """
+    excluded = np.zeros(labels.shape[0], dtype=bool)
+    for criterion, excluding_labels in rules.items():
+        codes = [ELIGIBILITY_CODES[label] for label in excluding_labels]
+        excluded |= np.isin(labels[:, _criterion_index(criterion)], codes)
+    return excluded
+
+
+def rank_records(scores, excluded=None):
+    """Return record indices ordered by descending score, excluded records last."""
+    keys = np.asarray(scores, dtype=np.float64).copy()
+    if excluded is not None:
+        keys[excluded] = -np.inf
+    return np.argsort(-keys, kind="stable")
+
+
+def top_k(scores, k, excluded=None):
+    """Return the indices of the k best scoring records, ordered by descending score."""
+    keys = np.asarray(scores, dtype=np.float64).copy()
+    if excluded is not None:
+        keys[excluded] = -np.inf
+    k = min(k, len(keys))
+    if k == 0:
+        return np.array([], dtype=np.int64)
+    candidates = np.argpartition(-keys, k - 1)[:k]
+    return candidates[np.argsort(-keys[candidates], kind="stable")]
+
+
+def recall_at_k(ranking, gold, k):
+    """
+    Compute the recall of the first k ranked records.
+
+    Args:
+        ranking (np.ndarray): Record indices, e.g. from `rank_records`.
+        gold (np.ndarray): Boolean array, True for records included in the review.
+        k (int): Number of screened records.
+    """
+    gold = np.asarray(gold, dtype=bool)
+    num_relevant = gold.sum()
+    if num_relevant == 0:
+        return 0.0
+    return float(gold[ranking[:k]].sum() / num_relevant)
+
+
+def work_saved_over_sampling(ranking, gold, recall=0.95):
+    """
+    Compute the work saved over sampling (WSS@recall) of a ranking.
+
+    This is the fraction of records that can be left unscreened when screening
+    in ranked order until the target recall is reached, minus the fraction
+    saved by random sampling at the same recall.
+    """
+    gold = np.asarray(gold, dtype=bool)
+    num_relevant = gold.sum()
+    if num_relevant == 0:
+        return 0.0
+    found = np.cumsum(gold[ranking])
+    # number of records to screen until the target recall is reached
+    num_screened = int(np.searchsorted(found, np.ceil(recall * num_relevant))) + 1
+    return float((len(gold) - num_screened) / len(gold) - (1 - recall))
+
+
+def screening_metrics(scores, gold, ks=(10, 50, 100), excluded=None, recall=0.95):
+    """
+    Compute recall@k and workload reduction metrics of the screening scores against gold labels.
+
+    Args:
+        scores (np.ndarray): Record scores, e.g. from `score_label_matrix`.
+        gold (np.ndarray): Boolean array, True for records included in the review.
+        ks (tuple): The k values to compute recall@k for.
+        excluded (np.ndarray): Optional exclusion mask from `exclusion_mask`.
+        recall (float): Target recall of the WSS metric.
+    Returns:
+        dict: Metrics keyed by name, e.g. "recall@10" and "wss@95".
+    """
+    ranking = rank_records(scores, excluded)
+    metrics = {f"recall@{k}": recall_at_k(ranking, gold, k) for k in ks}
+    metrics[f"wss@{int(round(recall * 100))}"] = work_saved_over_sampling(ranking, gold, recall)
+    if excluded is not None:
+        gold = np.asarray(gold, dtype=bool)
+        metrics["excluded"] = float(excluded.mean()) if len(excluded) else 0.0
+        metrics["recall_after_exclusion"] = float(gold[~excluded].sum() / gold.sum()) if gold.sum() else 0.0
+    return metrics
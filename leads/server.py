@@ -0,0 +1,252 @@
+"""An ASGI service exposing the `leads.api` tasks over HTTP.
+
+Concurrent requests for the same task and parameters are micro-batched into one
+`batch_*` call, identical in-flight requests (same paper and same parameters) are
+coalesced into one, results are cached, and the number of in-flight requests of
+each tenant (the "X-Tenant-ID" header) is limited. A batch that fails is retried one
+request at a time, so only the requests that caused the error fail.
+
+Run it with:
+    python -m leads.server --port 8000
+    python -m leads.server --backend fake --fake-response '{"evaluations": []}'  # stub model, no GPU
+"""
+
+import json
+import asyncio
+import argparse
+from collections import Counter
+
+from . import api
+from .cache import ResultCache, task_key
+from .client import OpenAIBackend, get_backend, set_backend
+from .dedup import is_failed_result
+
+PICO_NAMES = ["population", "intervention", "comparison", "outcome"]
+
+
+def _api_task(name):
+    def batch_fn(items, **params):
+        return getattr(api, name)(items, **params)
+    return batch_fn
+
+
+def _search(pico_list):
+    return api.batch_search_query_generation([{name: pico.get(name) or "" for name in PICO_NAMES} for pico in pico_list])
+
+
+# path -> (batch function, per-request item field or None for the PICO itself, shared parameter names)
+TASKS = {
+    "/search": (_search, None, []),
+    "/screening": (_api_task("batch_screening_study"), "paper_content", PICO_NAMES),
+    "/extract/study_characteristics": (_api_task("batch_extract_study_characteristics"), "paper_content", ["fields_info"]),
+    "/extract/population_statistics": (_api_task("batch_extract_population_statistics"), "paper_content", ["measureDef", "paramType", "unitOfMeasure", "groupDef"]),
+    "/extract/arm_design": (_api_task("batch_extract_arm_design"), "paper_content", []),
+    "/extract/trial_result": (_api_task("batch_extract_trial_result"), "paper_content", ["outcome_def", "group_def"]),
+}
+
+
+def validate_payload(path, payload):
+    """Return the error message of an invalid request body, or None if it is valid."""
+    if not isinstance(payload, dict):
+        return "The request body must be a JSON object."
+    _, item_name, param_names = TASKS[path]
+    if item_name is not None and not isinstance(payload.get(item_name), str):
+        return f"Missing or invalid field: {item_name}."
+    if path in ("/search", "/screening"):
+        if not any(payload.get(name) for name in PICO_NAMES):
+            return f"At least one of {', '.join(PICO_NAMES)} must be provided."
+        return None
+    missing = [name for name in param_names if payload.get(name) in (None, "", [])]
+    if missing:
+        return f"Missing fields: {', '.join(missing)}."
+    return None
+
+
+class MicroBatcher:
+    """Group concurrent requests with the same parameters into one batch call.
+
+    A batch is sent when it has `max_batch_size` items or `max_wait` seconds after its first item.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=16, max_wait=0.05):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._groups = {}
+
+    async def submit(self, item, params):
+        loop = asyncio.get_running_loop()
+        key = task_key("batch", **params)
+        future = loop.create_future()
+        group = self._groups.setdefault(key, {"params": params, "items": [], "timer": None})
+        group["items"].append((item, future))
+        if len(group["items"]) >= self.max_batch_size:
+            self._flush(key)
+        elif group["timer"] is None:
+            group["timer"] = loop.call_later(self.max_wait, self._flush, key)
+        return await future
+
+    def _flush(self, key):
+        group = self._groups.pop(key, None)
+        if group is None:
+            return
+        if group["timer"] is not None:
+            group["timer"].cancel()
+        asyncio.ensure_future(self._run(group))
+
+    async def _run(self, group):
+        items = [item for item, _ in group["items"]]
+        try:
+            results = await asyncio.to_thread(self.batch_fn, items, **group["params"])
+        except Exception as e:
+            if len(items) > 1:
+                # the batch mixes unrelated requests, so find the ones that fail on their own
+                await asyncio.gather(*(self._run({"params": group["params"], "items": [entry]}) for entry in group["items"]))
+                return
+            for _, future in group["items"]:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(group["items"], results):
+            if not future.done():
+                future.set_result(result)
+
+
+class LeadsService:
+    """
+    The ASGI application.
+
+    Args:
+        max_batch_size (int): Max number of requests per batch call.
+        max_wait (float): Max seconds a request waits for its batch to fill up.
+        tenant_concurrency (int): Max number of in-flight requests per tenant, more are rejected with 429.
+        cache_path (str): Path of the SQLite result cache, ":memory:" to only cache in this process.
+    """
+
+    def __init__(self, max_batch_size=16, max_wait=0.05, tenant_concurrency=8, cache_path=":memory:"):
+        self.tenant_concurrency = tenant_concurrency
+        self.cache = ResultCache(cache_path)
+        self._batchers = {path: MicroBatcher(fn, max_batch_size, max_wait) for path, (fn, _, _) in TASKS.items()}
+        self._inflight = {}
+        self._tenant_inflight = Counter()
+
+    async def run_task(self, path, payload):
+        """
+        Run a task for one request, reusing cached and in-flight results of identical requests.
+
+        Failed results (see `leads.dedup.is_failed_result`), e.g. the fallback of a failed model
+        call, are returned but not cached, so the next identical request calls the model again.
+        """
+        _, item_name, param_names = TASKS[path]
+        item = payload.get(item_name) if item_name else {name: payload.get(name) for name in PICO_NAMES}
+        params = {name: payload.get(name) for name in param_names if payload.get(name) is not None}
+        key = task_key(path, item=item, model=get_backend().cache_id(), **params)
+
+        cached = self.cache.get_many([key], "service")
+        if key in cached:
+            return cached[key]
+        if key not in self._inflight:
+            future = asyncio.ensure_future(self._batchers[path].submit(item, params))
+            self._inflight[key] = future
+
+            def done(future, key=key):
+                self._inflight.pop(key, None)
+                if not future.cancelled() and future.exception() is None and not is_failed_result(future.result()):
+                    self.cache.put_many({key: future.result()}, "service")
+
+            future.add_done_callback(done)
+        # shield the shared future, so a disconnecting client does not cancel it for the others
+        return await asyncio.shield(self._inflight[key])
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            return
+
+        path, method = scope["path"].rstrip("/") or "/", scope["method"]
+        if path == "/health" and method == "GET":
+            return await _send_json(send, 200, {"status": "ok"})
+        if path not in TASKS:
+            return await _send_json(send, 404, {"error": f"Unknown path: {path}"})
+        if method != "POST":
+            return await _send_json(send, 405, {"error": "Only POST is supported."})
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        try:
+            payload = json.loads(body or b"{}")
+        except json.JSONDecodeError:
+            return await _send_json(send, 400, {"error": "The request body must be JSON."})
+        error = validate_payload(path, payload)
+        if error is not None:
+            return await _send_json(send, 400, {"error": error})
+
+        headers = dict(scope.get("headers") or [])
+        tenant = headers.get(b"x-tenant-id", b"default").decode("latin-1")
+        if self._tenant_inflight[tenant] >= self.tenant_concurrency:
+            return await _send_json(send, 429, {"error": f"Too many concurrent requests for tenant {tenant}."})
+
+        self._tenant_inflight[tenant] += 1
+        try:
+            result = await self.run_task(path, payload)
+        except Exception as e:
+            return await _send_json(send, 500, {"error": str(e)})
+        finally:
+            self._tenant_inflight[tenant] -= 1
+
+        if path == "/screening":
+            evaluations, score = result
+            result = {"evaluations": evaluations, "score": score}
+        elif path == "/search":
+            result = {"queries": result}
+        return await _send_json(send, 200, result)
+
+
+async def _send_json(send, status, obj):
+    body = json.dumps(obj).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def create_app(max_batch_size=16, max_wait=0.05, tenant_concurrency=8, cache_path=":memory:"):
+    """Create the ASGI application, with one pooled upstream client shared by all requests."""
+    set_backend(OpenAIBackend(persistent=True))
+    return LeadsService(max_batch_size, max_wait, tenant_concurrency, cache_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the leads.api tasks over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--backend", default="openai", choices=["openai", "fake"], help="Use 'fake' to test without a model server.")
+    parser.add_argument("--fake-response", default="{}", help="Response of the fake backend.")
+    parser.add_argument("--max-batch-size", type=int, default=16)
+    parser.add_argument("--max-wait", type=float, default=0.05)
+    parser.add_argument("--tenant-concurrency", type=int, default=8)
+    parser.add_argument("--cache-path", default=":memory:")
+    args = parser.parse_args()
+
+    import uvicorn
+    app = create_app(args.max_batch_size, args.max_wait, args.tenant_concurrency, args.cache_path)
+    if args.backend == "fake":
+        set_backend("fake", response=args.fake_response)
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
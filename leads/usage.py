@@ -0,0 +1,117 @@
+import os
+import json
+import math
+import threading
+
+from .chunking import count_tokens
+
+# task of the calls made without one
+DEFAULT_TASK = "default"
+
+
+class UsageStats:
+    """
+    Token usage of the LEADS calls per task, and the throughput of the model server.
+
+    Args:
+        path (str): JSON file the stats are loaded from and saved to after each call, None to only keep them in memory.
+        max_samples (int): Max number of prompt and completion lengths kept per task, the oldest are dropped.
+    """
+
+    def __init__(self, path=None, max_samples=10_000):
+        self.path = path
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        # task -> {"prompt_tokens": [...], "completion_tokens": [...], "finish_reasons": {reason: count}}
+        self.tasks = {}
+        # (tokens, seconds) of each call
+        self.calls = []
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                payload = json.load(f)
+            self.tasks = payload["tasks"]
+            self.calls = [tuple(call) for call in payload["calls"]]
+
+    def record(self, task, prompts, outputs, seconds):
+        """
+        Record the outputs of one `call_leads` call.
+
+        Args:
+            task (str): The task of the prompts, e.g. "screening".
+            prompts (list[str]): The prompts.
+            outputs (list[dict]): The outputs of `LeadsBackend.generate_outputs`. Missing token counts
+                are counted with the tokenizer of `leads.chunking`.
+            seconds (float): The duration of the call.
+        """
+        prompt_tokens, completion_tokens, finish_reasons, total_completion_tokens = [], [], [], 0
+        for prompt, output in zip(prompts, outputs):
+            prompt_tokens.append(output["prompt_tokens"] if output["prompt_tokens"] is not None else count_tokens(prompt))
+            responses = output["response"] if isinstance(output["response"], list) else [output["response"]]
+            for response, num_tokens, finish_reason in zip(responses, output["completion_tokens"], output["finish_reasons"]):
+                # failed requests have no completion to learn from
+                if finish_reason == "error":
+                    continue
+                num_tokens = num_tokens if num_tokens is not None else count_tokens(response or "")
+                total_completion_tokens += num_tokens
+                finish_reasons.append(finish_reason)
+                # a completion cut at max_tokens does not tell its real length
+                if finish_reason != "length":
+                    completion_tokens.append(num_tokens)
+
+        with self._lock:
+            stats = self.tasks.setdefault(task or DEFAULT_TASK, {"prompt_tokens": [], "completion_tokens": [], "finish_reasons": {}})
+            stats["prompt_tokens"] = (stats["prompt_tokens"] + prompt_tokens)[-self.max_samples:]
+            stats["completion_tokens"] = (stats["completion_tokens"] + completion_tokens)[-self.max_samples:]
+            for finish_reason in finish_reasons:
+                stats["finish_reasons"][str(finish_reason)] = stats["finish_reasons"].get(str(finish_reason), 0) + 1
+            self.calls = (self.calls + [(sum(prompt_tokens) + total_completion_tokens, seconds)])[-self.max_samples:]
+            if self.path is not None:
+                self._save()
+
+    def completion_tokens(self, task):
+        """Return the recorded lengths of the complete (not cut at max_tokens) completions of the task."""
+        return list(self.tasks.get(task or DEFAULT_TASK, {}).get("completion_tokens", []))
+
+    def mean_completion_tokens(self, task):
+        """Return the mean completion length of the task, or None if nothing was recorded."""
+        lengths = self.completion_tokens(task)
+        return sum(lengths) / len(lengths) if lengths else None
+
+    def completion_quantile(self, task, q=0.99):
+        """Return the q-quantile of the completion lengths of the task, or None if nothing was recorded."""
+        lengths = sorted(self.completion_tokens(task))
+        if not lengths:
+            return None
+        return lengths[min(int(q * len(lengths)), len(lengths) - 1)]
+
+    def output_budget(self, task, quantile=0.99, margin=1.1, min_samples=20, default=1024):
+        """
+        Return the `max_tokens` of the task: the `quantile` of its completion lengths times `margin`.
+
+        Returns `default` until `min_samples` completions of the task are recorded.
+        """
+        if len(self.completion_tokens(task)) < min_samples:
+            return default
+        return math.ceil(self.completion_quantile(task, quantile) * margin)
+
+    def throughput(self):
+        """Return the measured throughput of the model server in (prompt + completion) tokens per second, or None."""
+        tokens = sum(num_tokens for num_tokens, _ in self.calls)
+        seconds = sum(seconds for _, seconds in self.calls)
+        return tokens / seconds if seconds > 0 else None
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"tasks": self.tasks, "calls": self.calls}, f)
+        os.replace(tmp_path, self.path)
+
+
+_usage_stats = None
+
+def get_usage_stats():
+    """Return the stats recorded by `call_leads`, persisted to the LEADS_USAGE_PATH file if set."""
+    global _usage_stats
+    if _usage_stats is None:
+        _usage_stats = UsageStats(os.getenv("LEADS_USAGE_PATH"))
+    return _usage_stats